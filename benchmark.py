@@ -0,0 +1,382 @@
+'''Benchmarks for the propagators, the models and model construction.
+
+   Every case is timed over a number of runs (the fastest is kept) and
+   reported with
+      'wall', 'cpu'     seconds, of the fastest run
+      'decisions', 'prunings'   BT statistics (0 for build cases)
+      'nodes_per_s'     decisions per CPU second
+      'peak_kb'         peak memory allocated by Python during one
+                        extra run, traced with tracemalloc
+      'status'          'ok', 'timeout' or 'error'
+
+   Cases are
+      queens-<n>-<prop>          find the first solution of nQueens(n)
+      sudoku-m<k>-<board>-<prop> find the first solution of board b1-b7
+                                 or g1 under sudoku_csp_model_<k>
+      build-...                  construct models (nothing searched)
+      gac-root-...               prop_GAC at the root of a model (the
+                                 initial GAC fixpoint, no search);
+                                 gac-root-sudoku-m1-b1-list runs it
+                                 with the original ListQueue
+      queue-<impl>-<n>           GAC queue traffic on n items with
+                                 propagators.Queue (deque) or the
+                                 original list backed ListQueue
+      <search case>-<heuristic>  a queens or sudoku case searched with
+                                 a heuristic of csp_heuristics.HEURISTICS
+                                 (with --heuristics)
+
+   where <prop> is a name of propagators.PROPAGATORS (BT, FC, GAC or
+   CT). Combinations that take minutes are left out (e.g. FC on
+   model_2, whose 9 variable constraints are only checked once 8 of
+   their variables are assigned); --all runs them too, subject to
+   --timeout.
+
+   Results are written as JSON with --out. Given a --baseline written
+   that way, every case is compared with it: a case whose CPU time
+   grew by more than --tolerance (and by more than a millisecond), or
+   whose status, decisions or prunings changed, is reported, and the
+   exit status is 1 if there were any.
+
+      python benchmark.py --out base.json
+      (change things)
+      python benchmark.py --baseline base.json --only sudoku
+'''
+
+import sys
+import time
+import json
+import signal
+import platform
+import argparse
+import tracemalloc
+
+import propagators
+from cspbase import BT, clear_relations
+from propagators import prop_GAC, Queue, PROPAGATORS
+from csp_sample_run import nQueens
+from sudoku_csp import sudoku_csp_model_1, sudoku_csp_model_2, SudokuTemplate
+from csp_heuristics import HEURISTICS
+from sudoku_sample_run import b1, b2, b3, b4, b5, b6, b7, g1_test_board_0
+
+MODELS = {1: sudoku_csp_model_1, 2: sudoku_csp_model_2}
+BOARDS = [('b1', b1), ('b2', b2), ('b3', b3), ('b4', b4), ('b5', b5),
+          ('b6', b6), ('b7', b7), ('g1', g1_test_board_0)]
+QUEENS = [8, 12, 16, 20, 30, 50]
+
+
+class CaseTimeout(Exception):
+    '''Raised when a case runs past its timeout'''
+
+
+def on_alarm(signum, frame):
+    raise CaseTimeout()
+
+
+def search_case(make_csp, prop, heuristic=None):
+    '''Return a case function searching the CSP made by make_csp for
+       its first solution with propagator prop and the named heuristic
+       (timing only the search)'''
+    def case():
+        csp = make_csp()
+        solver = BT(csp)
+        if heuristic is not None:
+            solver.set_heuristics(*HEURISTICS[heuristic])
+        stime = time.perf_counter()
+        ctime = time.process_time()
+        try:
+            for _ in solver.solutions(PROPAGATORS[prop], limit=1):
+                pass
+        finally:
+            case.wall = time.perf_counter() - stime
+            case.cpu = time.process_time() - ctime
+            case.decisions = solver.nDecisions
+            case.prunings = solver.nPrunings
+    return case
+
+
+class ListQueue:
+    '''The original list backed GAC queue (linear dequeue and
+       contains), kept to compare propagators.Queue with'''
+    def __init__(self):
+        self.items = []
+
+    def dequeue(self):
+        x = None
+        if len(self.items) > 0:
+            x = self.items[0]
+            self.items = self.items[1:]
+        return x
+
+    def is_empty(self):
+        return len(self.items) == 0
+
+    def enqueue(self, item):
+        self.items.append(item)
+
+    def q_len(self):
+        return len(self.items)
+
+    def empty(self):
+        self.items = []
+
+    def contains(self, item):
+        return item in self.items
+
+
+def root_case(make_csp, prop, queue=None):
+    '''Return a case function timing prop at the root of the CSP made
+       by make_csp (with a trail attached, as in search). If queue is
+       given, the propagators use it as their GAC queue class in place
+       of propagators.Queue.'''
+    def case():
+        csp = make_csp()
+        csp.set_trail([])
+        saved = propagators.Queue
+        if queue is not None:
+            propagators.Queue = queue
+        stime = time.perf_counter()
+        ctime = time.process_time()
+        try:
+            prop(csp)
+        finally:
+            propagators.Queue = saved
+        case.wall = time.perf_counter() - stime
+        case.cpu = time.process_time() - ctime
+        case.decisions = 0
+        case.prunings = len(csp.trail)
+        csp.set_trail(None)
+    return case
+
+
+def queue_case(make_queue, n):
+    '''Return a case function putting n items on a queue made by
+       make_queue and then, as GAC_helper does, taking each off and
+       putting back the items not already queued among the next few'''
+    def case():
+        stime = time.perf_counter()
+        ctime = time.process_time()
+        q = make_queue()
+        for i in range(n):
+            q.enqueue(i)
+        rounds = 0
+        while not q.is_empty():
+            x = q.dequeue()
+            rounds = rounds + 1
+            if rounds < 2 * n:
+                for y in range(x, x + 3):
+                    if not q.contains(y % n):
+                        q.enqueue(y % n)
+        case.wall = time.perf_counter() - stime
+        case.cpu = time.process_time() - ctime
+        case.decisions = 0
+        case.prunings = 0
+    return case
+
+
+def build_case(build):
+    '''Return a case function timing build(), starting without any
+       shared relations'''
+    def case():
+        clear_relations()
+        stime = time.perf_counter()
+        ctime = time.process_time()
+        build()
+        case.wall = time.perf_counter() - stime
+        case.cpu = time.process_time() - ctime
+        case.decisions = 0
+        case.prunings = 0
+    return case
+
+
+def slow(prop, model=None, n=None):
+    '''True for the combinations left out unless --all is given'''
+    if model == 2:
+        return prop not in ('GAC', 'CT')
+    if model == 1:
+        return prop == 'BT'
+    return prop == 'BT' and n > 16
+
+
+def search_instances(run_all=False):
+    '''Return the list of (name, function making the CSP, propagator)
+       of the search cases'''
+    instances = []
+    for n in QUEENS:
+        for prop in PROPAGATORS:
+            if run_all or not slow(prop, n=n):
+                instances.append(("queens-{}-{}".format(n, prop), lambda n=n: nQueens(n), prop))
+    for model in MODELS:
+        for name, board in BOARDS:
+            for prop in PROPAGATORS:
+                if run_all or not slow(prop, model=model):
+                    make = lambda model=model, board=board: MODELS[model](board)[0]
+                    instances.append(("sudoku-m{}-{}-{}".format(model, name, prop), make, prop))
+    return instances
+
+
+def make_cases(run_all=False, heuristics=False):
+    '''Return the list of (name, case function) to run'''
+    cases = []
+    for name, make, prop in search_instances(run_all):
+        cases.append((name, search_case(make, prop)))
+        if heuristics:
+            for heuristic in HEURISTICS:
+                if heuristic != 'mrv':
+                    cases.append(("{}-{}".format(name, heuristic),
+                                  search_case(make, prop, heuristic)))
+
+    def build_boards(model):
+        for name, board in BOARDS:
+            MODELS[model](board)
+
+    def load_boards(template):
+        for name, board in BOARDS:
+            template.load(board)
+
+    for model in MODELS:
+        cases.append(("gac-root-sudoku-m{}-b1".format(model),
+                      root_case(lambda model=model: MODELS[model](b1)[0], prop_GAC)))
+    cases.append(("gac-root-sudoku-m1-b1-list",
+                  root_case(lambda: MODELS[1](b1)[0], prop_GAC, ListQueue)))
+    cases.append(("gac-root-queens-50", root_case(lambda: nQueens(50), prop_GAC)))
+    for n in (1000, 5000):
+        cases.append(("queue-list-{}".format(n), queue_case(ListQueue, n)))
+        cases.append(("queue-deque-{}".format(n), queue_case(Queue, n)))
+
+    for n in (20, 50):
+        cases.append(("build-queens-{}".format(n), build_case(lambda n=n: nQueens(n))))
+    for model in MODELS:
+        cases.append(("build-sudoku-m{}".format(model),
+                      build_case(lambda model=model: build_boards(model))))
+        template = SudokuTemplate(model)
+        cases.append(("build-template-m{}".format(model),
+                      build_case(lambda template=template: load_boards(template))))
+    return cases
+
+
+def run_case(name, case, repeat=3, timeout=None, memory=True):
+    '''Run case repeat times (and once more under tracemalloc if memory)
+       and return its result dict'''
+    result = {'case': name, 'status': 'ok', 'wall': None, 'cpu': None,
+              'decisions': None, 'prunings': None, 'nodes_per_s': None,
+              'peak_kb': None}
+    use_alarm = timeout is not None and hasattr(signal, 'setitimer')
+    if use_alarm:
+        old_handler = signal.signal(signal.SIGALRM, on_alarm)
+    try:
+        for run in range(repeat + (1 if memory else 0)):
+            tracing = memory and run == repeat
+            if tracing:
+                tracemalloc.start()
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, timeout * (3 if tracing else 1))
+            try:
+                case()
+            finally:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+                if tracing:
+                    result['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+                    tracemalloc.stop()
+            if tracing:
+                continue
+            if result['cpu'] is None or case.cpu < result['cpu']:
+                result['wall'] = case.wall
+                result['cpu'] = case.cpu
+            result['decisions'] = case.decisions
+            result['prunings'] = case.prunings
+    except CaseTimeout:
+        result['status'] = 'timeout'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    finally:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, old_handler)
+    if result['status'] == 'ok' and result['cpu'] and result['decisions']:
+        result['nodes_per_s'] = result['decisions'] / result['cpu']
+    return result
+
+
+def compare(results, baseline, tolerance=0.25):
+    '''Return a list of (case, message) for the results that regressed
+       against the baseline results (see the module docstring)'''
+    base = dict((r['case'], r) for r in baseline)
+    problems = []
+    for r in results:
+        b = base.get(r['case'])
+        if b is None:
+            continue
+        if r['status'] != b['status']:
+            problems.append((r['case'], "status {} (was {})".format(r['status'], b['status'])))
+            continue
+        if r['status'] != 'ok':
+            continue
+        for key in ('decisions', 'prunings'):
+            if r[key] != b[key]:
+                problems.append((r['case'], "{} {} (was {})".format(key, r[key], b[key])))
+        if r['cpu'] > b['cpu'] * (1 + tolerance) and r['cpu'] - b['cpu'] > 0.001:
+            problems.append((r['case'], "cpu {:.4f}s (was {:.4f}s, {:+.0f}%)".format(
+                r['cpu'], b['cpu'], 100 * (r['cpu'] / b['cpu'] - 1))))
+    return problems
+
+
+def print_result(r):
+    if r['status'] != 'ok':
+        print("{:32} {}".format(r['case'], r['status']))
+        return
+    print("{:32} wall {:9.4f}s cpu {:9.4f}s {:>8} dec {:>9} prun {:>10} nodes/s {:>9} KB".format(
+        r['case'], r['wall'], r['cpu'], r['decisions'], r['prunings'],
+        "{:.0f}".format(r['nodes_per_s']) if r['nodes_per_s'] else '-',
+        r['peak_kb'] if r['peak_kb'] is not None else '-'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark propagators and models.")
+    parser.add_argument("--only", action="append", default=[],
+                        help="run only cases whose name contains this (repeatable)")
+    parser.add_argument("--all", action="store_true",
+                        help="include the slow propagator/model combinations")
+    parser.add_argument("--heuristics", action="store_true",
+                        help="also search every case with each ordering heuristic")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="per run time limit in seconds")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the tracemalloc run measuring peak memory")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by --out")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative CPU time increase over the baseline")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, case in make_cases(args.all, args.heuristics):
+        if args.only and not any(s in name for s in args.only):
+            continue
+        r = run_case(name, case, args.repeat, args.timeout, not args.no_memory)
+        print_result(r)
+        sys.stdout.flush()
+        results.append(r)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+                       'results': results}, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        problems = compare(results, baseline, args.tolerance)
+        for name, message in problems:
+            print("REGRESSION {}: {}".format(name, message))
+        if problems:
+            print("{} regressions against {}".format(len(problems), args.baseline))
+            return 1
+        print("no regressions against {}".format(args.baseline))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
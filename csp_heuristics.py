@@ -0,0 +1,114 @@
+'''Variable and value ordering heuristics for BT.
+
+   BT branches on the MRV variable (smallest current domain) and tries
+   its values in domain order unless given other heuristics:
+
+      solver = BT(csp)
+      solver.set_heuristics(dom_wdeg, lcv)
+      solver.bt_search(prop_GAC)
+
+   A variable ordering heuristic is called as var_order(bt, vars) with
+   the list of unassigned variables and returns the one to branch on
+   next. A value ordering heuristic is called as val_order(bt, var,
+   vals) and returns the values vals of var in the order to try them.
+   Ties are broken by the first variable found, or at random if
+   BT.set_random was used.
+
+      mrv       smallest current domain (as BT's default, but by
+                scanning the list)
+      dom_ddeg  smallest current domain / dynamic degree, the number of
+                constraints over the variable and another unassigned
+                variable
+      dom_wdeg  smallest current domain / weighted degree, the sum of
+                the weights of those constraints. The propagators add
+                one to a constraint's weight every time it fails, so
+                search is drawn to the variables of the constraints
+                that fail most (the weights are kept between searches;
+                see reset_weights)
+      lcv       values in the order of how many values of the
+                neighbouring unassigned variables lose their last
+                support, fewest first
+
+   benchmark.py --heuristics compares their decisions and times on the
+   sample instances.
+'''
+
+def scan_min(bt, vars, score):
+    '''Internal routine. Return the variable of vars with the smallest
+       score, ties broken as described in the module docstring'''
+    best = None
+    ties = []
+    for var in vars:
+        s = score(var)
+        if best is None or s < best:
+            best = s
+            ties = [var]
+        elif s == best:
+            ties.append(var)
+    if bt.rng is not None and len(ties) > 1:
+        return bt.rng.choice(ties)
+    return ties[0]
+
+
+def active_cons(csp, var):
+    '''Internal routine. The constraints over var and at least one other
+       unassigned variable'''
+    return [c for c in csp.get_cons_with_var(var) if c.get_n_unasgn() > 1]
+
+
+def mrv(bt, vars):
+    '''Variable with the smallest current domain'''
+    return scan_min(bt, vars, lambda var: var.cur_domain_size())
+
+
+def dom_ddeg(bt, vars):
+    '''Variable with the smallest current domain / dynamic degree'''
+    csp = bt.csp
+
+    def score(var):
+        return var.cur_domain_size() / max(len(active_cons(csp, var)), 1)
+    return scan_min(bt, vars, score)
+
+
+def dom_wdeg(bt, vars):
+    '''Variable with the smallest current domain / weighted degree'''
+    csp = bt.csp
+
+    def score(var):
+        wdeg = 0
+        for c in active_cons(csp, var):
+            wdeg = wdeg + c.weight
+        return var.cur_domain_size() / max(wdeg, 1)
+    return scan_min(bt, vars, score)
+
+
+def lcv(bt, var, vals):
+    '''Values of var, least constraining first. Each value is assigned in
+       turn (and unassigned again) to count the values of the other
+       unassigned variables of var's constraints left without support'''
+    if len(vals) < 2:
+        return vals
+    cons = active_cons(bt.csp, var)
+    cost = dict()
+    for val in vals:
+        var.assign(val)
+        n = 0
+        for c in cons:
+            for other in c.get_unasgn_vars():
+                for b in other.cur_domain():
+                    if not c.has_support(other, b):
+                        n = n + 1
+        var.unassign()
+        cost[val] = n
+    return sorted(vals, key=lambda val: cost[val])
+
+
+def reset_weights(csp):
+    '''Set the weight of every constraint of csp back to 1'''
+    for c in csp.get_all_cons():
+        c.weight = 1
+
+
+#short names of the (var_order, val_order) pairs, as used by benchmark.py
+HEURISTICS = {'mrv': (None, None), 'ddeg': (dom_ddeg, None), 'wdeg': (dom_wdeg, None),
+              'mrv+lcv': (None, lcv), 'wdeg+lcv': (dom_wdeg, lcv)}
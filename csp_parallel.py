@@ -0,0 +1,167 @@
+'''Parallel search by splitting the search tree over worker processes.
+
+   A subproblem is a list giving the domain of every variable of the
+   CSP (in csp.vars order), i.e. a partial assignment (variables with
+   one value) together with the pruned domains of the others. Searching
+   one means loading it with Variable.set_initial_domain and running BT
+   on it.
+
+   parallel_search(make_csp, ...) first splits the problem at shallow
+   levels in the calling process, by branching on the MRV variable of
+   each subproblem (after propagating it) until there are split_factor
+   subproblems per worker. The subproblems go to a pool of workers, each
+   of which builds its own copy of the CSP with make_csp once. A worker
+   searches a subproblem for at most slice seconds (see BT.set_limits);
+   if that is not enough it returns the unexplored part of its search
+   tree as new subproblems, which are queued again. So work is
+   redistributed dynamically: hard subproblems are cut up while idle
+   workers take the pieces.
+
+   When only the first solution is wanted the remaining subproblems
+   are cancelled as soon as one is found, and the running ones are
+   stopped through an Event shared with the workers (see BT.set_limits)
+   at their next decision or during propagation. With all_solutions
+   every solution is counted.
+
+   make_csp must be picklable (e.g. a module level function or a
+   functools.partial of one) and return the same CSP in every process:
+   a CSP, or a tuple whose first item is one (as the sudoku models
+   return).
+
+      result = parallel_search(functools.partial(nQueens, 60), 'FC', workers=8)
+'''
+
+import os
+import time
+import collections
+import multiprocessing
+import concurrent.futures
+
+from cspbase import BT
+from propagators import PROPAGATORS
+
+WORKER_CSP = None   #the CSP of a worker process
+WORKER_STOP = None  #Event set when the workers should stop searching
+
+
+def build_csp(make_csp):
+    csp = make_csp()
+    if isinstance(csp, tuple):
+        csp = csp[0]
+    return csp
+
+
+def init_worker(make_csp, stop):
+    global WORKER_CSP, WORKER_STOP
+    WORKER_CSP = build_csp(make_csp)
+    WORKER_STOP = stop
+
+
+def search_node(csp, node, propagator, all_solutions, slice=None, decisions=None,
+                stop=None):
+    '''Search subproblem node of csp (None for the whole problem) with
+       propagator (a name of PROPAGATORS), stopping after slice seconds
+       or the given number of decisions, or when the Event stop is set.
+       Returns a dict with
+          'solutions'   solutions found, as lists of values in csp.vars
+                        order (only the first unless all_solutions)
+          'open'        unexplored subproblems if a limit stopped search
+          'decisions', 'prunings'   BT statistics'''
+    for k, var in enumerate(csp.vars):
+        var.set_initial_domain(None if node is None else node[k])
+    solver = BT(csp)
+    solver.set_limits(time=slice, decisions=decisions, stop=stop)
+    solver.open_nodes = []
+    found = []
+    for soln in solver.solutions(PROPAGATORS[propagator], None if all_solutions else 1):
+        found.append([soln[var] for var in csp.vars])
+    return {'solutions': found, 'open': solver.open_nodes,
+            'decisions': solver.nDecisions, 'prunings': solver.nPrunings}
+
+
+def worker_search(node, propagator, all_solutions, slice):
+    return search_node(WORKER_CSP, node, propagator, all_solutions, slice,
+                       stop=WORKER_STOP)
+
+
+def parallel_search(make_csp, propagator='GAC', workers=None, all_solutions=False,
+                    split_factor=8, slice=0.5):
+    '''Search the CSP made by make_csp with workers processes
+       (os.cpu_count() by default) as described in the module docstring.
+       Returns a dict with
+          'status'      'solved' or 'unsat'
+          'solution'    {variable name: value} of the first solution
+                        found, or None
+          'count'       number of solutions found (all of them if
+                        all_solutions)
+          'decisions', 'prunings'   totals over all processes
+          'subproblems' subproblems searched by the workers
+          'resplit'     subproblems given back unfinished and split
+          'time'        wall clock seconds'''
+    stime = time.perf_counter()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    csp = build_csp(make_csp)
+    names = [var.name for var in csp.vars]
+    stats = {'status': None, 'solution': None, 'count': 0, 'decisions': 0,
+             'prunings': 0, 'subproblems': 0, 'resplit': 0, 'time': 0.0}
+
+    def add(result):
+        stats['decisions'] += result['decisions']
+        stats['prunings'] += result['prunings']
+        stats['count'] += len(result['solutions'])
+        if result['solutions'] and stats['solution'] is None:
+            stats['solution'] = dict(zip(names, result['solutions'][0]))
+
+    #split at shallow levels, breadth first: a search stopped before its
+    #first decision leaves the values of the MRV variable as subproblems
+    queue = collections.deque([None])
+    target = split_factor * workers
+    while queue and len(queue) < target:
+        result = search_node(csp, queue.popleft(), propagator, all_solutions, decisions=0)
+        add(result)
+        if stats['solution'] is not None and not all_solutions:
+            queue.clear()
+            break
+        queue.extend(result['open'])
+
+    if queue:
+        stop = multiprocessing.Event()
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(make_csp, stop))
+        pending = set()
+        try:
+            while queue or pending:
+                while queue and len(pending) < 2 * workers:
+                    pending.add(pool.submit(worker_search, queue.popleft(), propagator,
+                                            all_solutions, slice))
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for f in done:
+                    result = f.result()
+                    stats['subproblems'] += 1
+                    add(result)
+                    if result['open']:
+                        stats['resplit'] += 1
+                        #deepest (smallest) subproblems were added first
+                        queue.extend(result['open'])
+                if stats['solution'] is not None and not all_solutions:
+                    #stop the running subproblems, drop the others
+                    stop.set()
+                    for f in pending:
+                        f.cancel()
+                    for f in concurrent.futures.as_completed(pending):
+                        if not f.cancelled():
+                            stats['subproblems'] += 1
+                            add(f.result())
+                    pending = set()
+                    break
+        finally:
+            stop.set()
+            for f in pending:
+                f.cancel()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    stats['status'] = 'solved' if stats['count'] else 'unsat'
+    stats['time'] = time.perf_counter() - stime
+    return stats
@@ -0,0 +1,193 @@
+'''Per-constraint and per-propagator profiling.
+
+   Profiling is opt-in: attaching a Profile to a CSP,
+
+      profile = Profile(csp)
+      BT(csp).bt_search(prop_GAC)
+      profile.detach()
+      profile.report()
+
+   makes the propagators record, for every constraint,
+      'revisions'   times a propagator revised (or, for prop_BT,
+                    checked) the constraint
+      'supports'    has_support calls
+      'scanned'     tuples examined (tuples tested against the current
+                    domains or with check, rows of an ArrayConstraint)
+      'prunings'    values pruned by its revisions
+      'wipeouts'    revisions that emptied a domain or failed
+      'time'        seconds spent in its revisions
+   and, for every propagator, the number of calls, the time spent, the
+   values pruned and the calls that returned False (BT wraps the
+   propagator while a profile is attached).
+
+   Without a profile the propagators only test csp.profile once per
+   revision. Counting supports and scanned tuples is done by wrappers
+   the profile installs on the constraints themselves, so it costs
+   nothing at all when no profile is attached.
+'''
+
+import sys
+import csv
+import time
+
+from cspbase import ArrayConstraint
+
+COLUMNS = ['revisions', 'supports', 'scanned', 'prunings', 'wipeouts', 'time']
+
+
+class Profile:
+    '''Statistics of the constraints and propagators of one CSP, gathered
+       while attached to it (see the module docstring)'''
+
+    def __init__(self, csp, attach=True):
+        self.csp = csp
+        self.cons = dict()      #constraint --> dict of COLUMNS
+        self.props = dict()     #propagator name --> dict of counts
+        for c in csp.get_all_cons():
+            self.cons[c] = dict.fromkeys(COLUMNS, 0)
+            self.cons[c]['time'] = 0.0
+        self.attached = False
+        if attach:
+            self.attach()
+
+    def attach(self):
+        '''Start profiling: make the propagators report to this profile
+           and wrap the constraints' support and check routines'''
+        if self.csp.profile is not None and self.csp.profile is not self:
+            self.csp.profile.detach()
+        self.csp.profile = self
+        if self.attached:
+            return
+        self.attached = True
+        for c in self.csp.get_all_cons():
+            if c not in self.cons:
+                self.cons[c] = dict.fromkeys(COLUMNS, 0)
+                self.cons[c]['time'] = 0.0
+            self.wrap(c)
+
+    def detach(self):
+        '''Stop profiling; the statistics gathered are kept'''
+        if self.csp.profile is self:
+            self.csp.profile = None
+        if not self.attached:
+            return
+        self.attached = False
+        for c in self.cons:
+            for name in ('has_support', 'tuple_is_valid', 'check', 'valid_rows'):
+                c.__dict__.pop(name, None)
+
+    def wrap(self, c):
+        '''Internal routine. Shadow c's methods with counting versions
+           (instance attributes, removed again by detach)'''
+        stats = self.cons[c]
+        has_support = c.has_support
+        tuple_is_valid = c.tuple_is_valid
+        check = c.check
+
+        def counted_has_support(var, val):
+            stats['supports'] += 1
+            return has_support(var, val)
+
+        def counted_tuple_is_valid(t):
+            stats['scanned'] += 1
+            return tuple_is_valid(t)
+
+        def counted_check(vals):
+            stats['scanned'] += 1
+            return check(vals)
+
+        c.has_support = counted_has_support
+        c.tuple_is_valid = counted_tuple_is_valid
+        c.check = counted_check
+        if isinstance(c, ArrayConstraint):
+            valid_rows = c.valid_rows
+
+            def counted_valid_rows(rows):
+                stats['scanned'] += len(rows)
+                return valid_rows(rows)
+
+            c.valid_rows = counted_valid_rows
+
+    #
+    #hooks called by the propagators and BT
+    #
+    def start(self, c):
+        '''Called before revising constraint c; returns a token for
+           revised'''
+        return time.perf_counter(), sum([var.curdom_size for var in c.scope])
+
+    def revised(self, c, token, status):
+        '''Called after revising constraint c, with the token start
+           returned and False if the revision failed'''
+        stime, size = token
+        stats = self.cons.get(c)
+        if stats is None:
+            stats = self.cons[c] = dict.fromkeys(COLUMNS, 0)
+        stats['time'] += time.perf_counter() - stime
+        stats['revisions'] += 1
+        stats['prunings'] += size - sum([var.curdom_size for var in c.scope])
+        if not status:
+            stats['wipeouts'] += 1
+
+    def propagator(self, prop):
+        '''Return prop wrapped to record its calls in this profile'''
+        name = getattr(prop, '__name__', str(prop))
+        if name not in self.props:
+            self.props[name] = {'calls': 0, 'prunings': 0, 'wipeouts': 0, 'time': 0.0}
+        stats = self.props[name]
+        csp = self.csp
+
+        def profiled(csp_, newVar=None):
+            size = sum([var.curdom_size for var in csp.vars])
+            stime = time.perf_counter()
+            status, prunings = prop(csp_, newVar)
+            stats['time'] += time.perf_counter() - stime
+            stats['calls'] += 1
+            stats['prunings'] += size - sum([var.curdom_size for var in csp.vars])
+            if not status:
+                stats['wipeouts'] += 1
+            return status, prunings
+        profiled.__name__ = name
+        return profiled
+
+    #
+    #output
+    #
+    def rows(self, sort='time'):
+        '''Return the constraint statistics as a list of dicts (with the
+           constraint's name and scope added), sorted by the column sort,
+           largest first'''
+        rows = []
+        for c, stats in self.cons.items():
+            row = {'constraint': c.name, 'scope': " ".join([var.name for var in c.scope])}
+            row.update(stats)
+            rows.append(row)
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        return rows
+
+    def report(self, sort='time', limit=20, file=None):
+        '''Print the propagator statistics and the limit constraints
+           with the largest values of sort (all if limit is None)'''
+        if file is None:
+            file = sys.stdout
+        print("Propagator          calls   prunings  wipeouts     time", file=file)
+        for name, stats in sorted(self.props.items()):
+            print("{:16} {:>8} {:>10} {:>9} {:>8.3f}s".format(
+                name, stats['calls'], stats['prunings'], stats['wipeouts'], stats['time']), file=file)
+        rows = self.rows(sort)
+        print("Constraint (by {})             revisions  supports    scanned  prunings  wipeouts     time".format(sort),
+              file=file)
+        for row in rows[:limit]:
+            print("{:30} {:>10} {:>9} {:>10} {:>9} {:>9} {:>8.3f}s".format(
+                row['constraint'][:30], row['revisions'], row['supports'], row['scanned'],
+                row['prunings'], row['wipeouts'], row['time']), file=file)
+        if limit is not None and len(rows) > limit:
+            print("... {} more constraints".format(len(rows) - limit), file=file)
+
+    def write_csv(self, filename, sort='time'):
+        '''Write the constraint statistics, sorted as by rows, to a CSV
+           file'''
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, ['constraint', 'scope'] + COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.rows(sort))
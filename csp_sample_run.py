@@ -1,6 +1,7 @@
 from cspbase import *
 from propagators import *
 import itertools
+import functools
 
 x = Variable('X', [1, 2, 3])
 y = Variable('Y', [1, 2, 3])
@@ -39,18 +40,6 @@ simpleCSP = CSP("SimpleEqs", [x,y,z,w])
 simpleCSP.add_constraint(c1)
 simpleCSP.add_constraint(c2)
 
-btracker = BT(simpleCSP)
-#btracker.trace_on()
-
-print("Plain Bactracking on simple CSP")
-btracker.bt_search(prop_BT)
-print("=======================================================")
-print("Forward Checking on simple CSP")
-btracker.bt_search(prop_FC)
-print("=======================================================")
-print("GAC on simple CSP")
-btracker.bt_search(prop_GAC)
-
 #Now n-Queens example
 
 def queensCheck(qi, qj, i, j):
@@ -59,6 +48,15 @@ def queensCheck(qi, qj, i, j):
     '''
     return i != j and abs(i-j) != abs(qi-qj)
 
+def queensTuples(qi, qj, dom):
+    '''Return the satisfying tuples of the constraint between the queens
+       in rows qi and qj'''
+    sat_tuples = []
+    for t in itertools.product(dom, dom):
+        if queensCheck(qi, qj, t[0], t[1]):
+            sat_tuples.append(t)
+    return sat_tuples
+
 def nQueens(n):
     '''Return an n-queens CSP'''
     i = 0
@@ -74,11 +72,10 @@ def nQueens(n):
     for qi in range(len(dom)):
         for qj in range(qi+1, len(dom)):
             con = Constraint("C(Q{},Q{})".format(qi+1,qj+1),[vars[qi], vars[qj]]) 
-            sat_tuples = []
-            for t in itertools.product(dom, dom):
-                if queensCheck(qi, qj, t[0], t[1]):
-                    sat_tuples.append(t)
-            con.add_satisfying_tuples(sat_tuples)
+            #the relation only depends on the distance between the rows,
+            #so constraints at the same distance share one
+            con.set_relation(get_relation(("queens", qj - qi, tuple(dom)),
+                                          functools.partial(queensTuples, qi, qj, dom)))
             cons.append(con)
     
     csp = CSP("{}-Queens".format(n), vars)
@@ -98,13 +95,26 @@ def solve_nQueens(n, propType, trace=False):
     elif propType == 'GAC':
         solver.bt_search(prop_GAC)
         
-#trace = True
-trace = False
-print("Plain Bactracking on 8-queens")
-solve_nQueens(8, 'BT', trace)
-print("=======================================================")
-print("Forward Checking 8-queens")
-solve_nQueens(8, 'FC', trace)
-print("=======================================================")
-print("GAC 8-queens")
-solve_nQueens(8, 'GAC', trace)
+if __name__ == "__main__":
+    btracker = BT(simpleCSP)
+    #btracker.trace_on()
+
+    print("Plain Bactracking on simple CSP")
+    btracker.bt_search(prop_BT)
+    print("=======================================================")
+    print("Forward Checking on simple CSP")
+    btracker.bt_search(prop_FC)
+    print("=======================================================")
+    print("GAC on simple CSP")
+    btracker.bt_search(prop_GAC)
+
+    #trace = True
+    trace = False
+    print("Plain Bactracking on 8-queens")
+    solve_nQueens(8, 'BT', trace)
+    print("=======================================================")
+    print("Forward Checking 8-queens")
+    solve_nQueens(8, 'FC', trace)
+    print("=======================================================")
+    print("GAC 8-queens")
+    solve_nQueens(8, 'GAC', trace)
@@ -0,0 +1,257 @@
+'''Save a built CSP to a binary file and load it back.
+
+   save_csp(csp, filename) writes the variables (names, domains and
+   initial domains, see Variable.set_initial_domain), the constraints
+   (names and scopes) and their tables. load_csp(filename) returns an
+   equal CSP without recomputing any tuples: the file is memory-mapped
+   and the tables are read straight out of the mapping, so processes
+   loading the same file share its pages.
+
+   File layout:
+      8 bytes     magic, b"CSPSNAP1"
+      8 bytes     length of the header (little endian)
+      header      JSON, describing the variables, the constraints and
+                  where each table is in the data section
+      data        tables, each an array of domain positions (one row
+                  per satisfying tuple, one column per scope variable)
+                  followed by its column index, every array starting
+                  on a 64 byte boundary
+
+   Identical tables are stored once. Table, ArrayConstraint and
+   AllDifferent constraints can be saved; FunctionConstraints cannot,
+   as their check functions are code. Domain values must be JSON
+   values (numbers, strings, ...).
+
+   Table constraints are loaded as ArrayConstraints whose table and
+   column index are views of the mapping (this needs numpy), or with
+   tables='tuples' as ordinary Constraints, with one shared Relation
+   per distinct table.
+'''
+
+import sys
+import json
+import mmap
+import array
+
+from cspbase import *
+
+MAGIC = b"CSPSNAP1"
+ALIGN = 64
+#typecodes of the array module for each table entry size in bytes
+TYPECODES = {1: 'B', 2: 'H', 4: 'I'}
+DTYPES = {1: 'uint8', 2: 'uint16', 4: 'uint32'}
+
+
+def entry_size(ndom):
+    '''Bytes needed to store a domain position when domains have at
+       most ndom values'''
+    if ndom <= 1 << 8:
+        return 1
+    elif ndom <= 1 << 16:
+        return 2
+    return 4
+
+
+def table_rows(c):
+    '''Internal routine. Return the satisfying tuples of table
+       constraint c as lists of domain positions'''
+    if isinstance(c, ArrayConstraint):
+        if c.table is None:
+            c.build()
+        return c.table.tolist()
+    rows = []
+    for t in c.sat_tuples:
+        row = []
+        for i, var in enumerate(c.scope):
+            b = var.dom_index.get(t[i])
+            if b is None:
+                break
+            row.append(b)
+        else:
+            rows.append(row)
+    return rows
+
+
+def column_index(rows, arity, sizes):
+    '''Internal routine. For each column i return (order, bounds):
+       order lists the rows sorted (stably) by their entry in column i
+       and order[bounds[b]:bounds[b+1]] are the rows with entry b'''
+    index = []
+    for i in range(arity):
+        order = sorted(range(len(rows)), key=lambda r: rows[r][i])
+        counts = [0] * (sizes[i] + 1)
+        for row in rows:
+            counts[row[i] + 1] += 1
+        for b in range(sizes[i]):
+            counts[b + 1] += counts[b]
+        index.append((order, counts))
+    return index
+
+
+def save_csp(csp, filename):
+    '''Write csp to filename (see the module docstring)'''
+    vars = csp.get_all_vars()
+    var_num = dict()
+    header = {'name': csp.name, 'byteorder': sys.byteorder,
+              'vars': [], 'cons': [], 'tables': []}
+    for k, var in enumerate(vars):
+        var_num[var] = k
+        init = [b for b in range(len(var.dom)) if (var.initdom >> b) & 1]
+        header['vars'].append({'name': var.name, 'dom': var.dom, 'init': init})
+
+    chunks = []         #arrays of the data section, in order
+    offset = [0]        #next free offset in the data section
+
+    def put(typecode, values):
+        a = array.array(typecode, values)
+        start = offset[0]
+        chunks.append((start, a))
+        offset[0] = start + len(a) * a.itemsize
+        offset[0] += -offset[0] % ALIGN
+        return start
+
+    tables = dict()     #table contents --> number in header['tables']
+    rel_tables = dict() #(relation, scope domains) --> table number
+    for c in csp.get_all_cons():
+        scope = [var_num[var] for var in c.scope]
+        if isinstance(c, AllDifferent):
+            header['cons'].append({'kind': 'alldiff', 'name': c.name, 'scope': scope})
+            continue
+        if isinstance(c, FunctionConstraint) or type(c) not in (Constraint, ArrayConstraint):
+            raise ValueError("cannot save constraint {} of type {}".format(c, type(c).__name__))
+        doms = tuple(tuple(var.dom) for var in c.scope)
+        key = None
+        if type(c) is Constraint:
+            key = (id(c.relation), doms)
+        if key in rel_tables:
+            num = rel_tables[key]
+        else:
+            sizes = [len(var.dom) for var in c.scope]
+            rows = sorted(map(tuple, table_rows(c)))
+            contents = (tuple(sizes), tuple(rows))
+            num = tables.get(contents)
+            if num is None:
+                num = len(header['tables'])
+                tables[contents] = num
+                size = entry_size(max(sizes + [1]))
+                entries = [b for row in rows for b in row]
+                entry = {'rows': len(rows), 'arity': len(sizes), 'sizes': sizes,
+                         'size': size, 'table': put(TYPECODES[size], entries),
+                         'order': [], 'bounds': []}
+                for order, bounds in column_index(rows, len(sizes), sizes):
+                    entry['order'].append(put('I', order))
+                    entry['bounds'].append(put('I', bounds))
+                header['tables'].append(entry)
+            if key is not None:
+                rel_tables[key] = num
+        kind = 'array' if isinstance(c, ArrayConstraint) else 'table'
+        header['cons'].append({'kind': kind, 'name': c.name, 'scope': scope, 'table': num})
+
+    text = json.dumps(header).encode('utf-8')
+    start = len(MAGIC) + 8 + len(text)
+    start += -start % ALIGN
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(text).to_bytes(8, 'little'))
+        f.write(text)
+        f.write(b'\0' * (start - f.tell()))
+        for pos, a in chunks:
+            f.write(b'\0' * (start + pos - f.tell()))
+            a.tofile(f)
+
+
+class Snapshot:
+    '''A snapshot file mapped into memory. Internal to load_csp: the
+       loaded constraints keep it (and hence the mapping) alive.'''
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a CSP snapshot".format(filename))
+        n = int.from_bytes(self.map[len(MAGIC):len(MAGIC) + 8], 'little')
+        start = len(MAGIC) + 8
+        self.header = json.loads(self.map[start:start + n].decode('utf-8'))
+        if self.header['byteorder'] != sys.byteorder:
+            raise ValueError("{} was written on a {} endian machine".format(
+                filename, self.header['byteorder']))
+        start += n
+        self.data = start + -start % ALIGN
+        self.view = memoryview(self.map)
+
+    def ints(self, pos, size, count):
+        '''The count unsigned integers of size bytes at pos in the data
+           section, as a memoryview (no copy)'''
+        start = self.data + pos
+        return self.view[start:start + size * count].cast(TYPECODES[size])
+
+    def array(self, pos, size, count):
+        '''Like ints, as a numpy array'''
+        return numpy.frombuffer(self.map, dtype=DTYPES[size], count=count,
+                                offset=self.data + pos)
+
+
+def load_csp(filename, tables='array'):
+    '''Return the CSP saved in filename by save_csp. Table constraints
+       become ArrayConstraints over the mapped file if tables is 'array'
+       (or ordinary Constraints if numpy is not installed) and
+       ordinary Constraints if tables is 'tuples'; ArrayConstraints
+       saved as such always come back as ArrayConstraints.'''
+    if tables not in ('array', 'tuples'):
+        raise ValueError("tables must be 'array' or 'tuples', not {!r}".format(tables))
+    if numpy is None:
+        tables = 'tuples'
+    snap = Snapshot(filename)
+    header = snap.header
+
+    vars = []
+    for entry in header['vars']:
+        var = Variable(entry['name'], entry['dom'])
+        init = entry['init']
+        if len(init) != len(var.dom):
+            var.set_initial_domain([var.dom[b] for b in init])
+        vars.append(var)
+    csp = CSP(header['name'], vars)
+
+    arrays = dict()     #table number --> (table, col_rows)
+    relations = dict()  #(table number, scope domains) --> Relation
+    for entry in header['cons']:
+        scope = [vars[k] for k in entry['scope']]
+        kind = entry['kind']
+        if kind == 'alldiff':
+            csp.add_constraint(AllDifferent(entry['name'], scope))
+            continue
+        if kind not in ('table', 'array'):
+            raise ValueError("unknown constraint kind {!r} in {}".format(kind, filename))
+        num = entry['table']
+        t = header['tables'][num]
+        if kind == 'array' or tables == 'array':
+            if num not in arrays:
+                table = snap.array(t['table'], t['size'], t['rows'] * t['arity'])
+                table = table.reshape(t['rows'], t['arity'])
+                col_rows = []
+                for i in range(t['arity']):
+                    order = snap.array(t['order'][i], 4, t['rows'])
+                    bounds = snap.ints(t['bounds'][i], 4, t['sizes'][i] + 1)
+                    col_rows.append([order[bounds[b]:bounds[b + 1]]
+                                     for b in range(t['sizes'][i])])
+                arrays[num] = (table, col_rows)
+            c = ArrayConstraint(entry['name'], scope)
+            c.table, c.col_rows = arrays[num]
+            c.dtype = c.table.dtype
+            c.chunks = [c.table]
+            c.snapshot = snap
+        else:
+            doms = tuple(tuple(var.dom) for var in scope)
+            relation = relations.get((num, doms))
+            if relation is None:
+                flat = snap.ints(t['table'], t['size'], t['rows'] * t['arity']).tolist()
+                arity = t['arity']
+                cols = [[doms[i][b] for b in flat[i::arity]] for i in range(arity)]
+                relation = Relation(zip(*cols))
+                relation.shared = True
+                relations[(num, doms)] = relation
+            c = Constraint(entry['name'], scope)
+            c.set_relation(relation)
+        csp.add_constraint(c)
+    return csp
@@ -0,0 +1,178 @@
+'''Search trace writers and reader.
+
+   JSONLinesTrace and BinaryTrace are TraceSinks (see cspbase) that
+   write the events of a BT search to a file for offline analysis:
+
+      solver = BT(csp)
+      trace = BinaryTrace("search.trace", sample=10)
+      solver.trace_on(trace)
+      solver.bt_search(prop_GAC)
+      trace.close()
+
+      for kind, level, var, value in read_trace("search.trace"):
+          ...
+
+   Events are buffered and written in blocks, so recording costs about
+   one method call per event; sampling (see TraceSink) bounds how many
+   events a long search produces.
+
+   A JSON lines trace starts every search with a line
+      {"event": "start", "csp": name, "vars": [names]}
+   followed by a line per event
+      {"event": kind, "level": level, "var": name, "value": value}
+   where var and value are left out when they do not apply, so values
+   must be JSON values. A binary trace starts every search with a
+   header record listing the variables and their domains, and writes
+   each event as a fixed size (16 byte) record of event kind (a byte),
+   level (an unsigned 32 bit integer, as a search can be deeper than
+   65535 levels), variable number and domain position. read_trace
+   reads either format and generates (kind, level, variable name,
+   value) tuples, with a ('start', 0, csp name, None) tuple for each
+   search.
+
+   Run as a script to print event counts of a trace file:
+
+      python csp_trace.py search.trace
+'''
+
+import sys
+import json
+import struct
+
+from cspbase import TraceSink
+
+KINDS = ['start', 'assign', 'prune', 'wipeout', 'backtrack', 'solution']
+KIND_CODES = dict((kind, i) for i, kind in enumerate(KINDS))
+MAGIC = b"CSPTRAC2"
+RECORD = struct.Struct("<B3xIii")   #kind, level, variable, domain position
+
+
+class JSONLinesTrace(TraceSink):
+    '''TraceSink writing a JSON lines file (see the module docstring)'''
+
+    def __init__(self, filename, sample=1, buffer_size=4096):
+        TraceSink.__init__(self, sample)
+        self.file = open(filename, 'w')
+        self.buffer = []
+        self.buffer_size = buffer_size
+
+    def start(self, csp):
+        TraceSink.start(self, csp)
+        self.buffer.append(json.dumps({'event': 'start', 'csp': csp.name,
+                                       'vars': [var.name for var in csp.vars]}))
+
+    def write(self, kind, level, var, value):
+        event = {'event': kind, 'level': level}
+        if var is not None:
+            event['var'] = var.name
+        if value is not None:
+            event['value'] = value
+        self.buffer.append(json.dumps(event))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append('')
+            self.file.write('\n'.join(self.buffer))
+            self.buffer = []
+
+    def finish(self):
+        self.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class BinaryTrace(TraceSink):
+    '''TraceSink writing a binary trace file (see the module docstring)'''
+
+    def __init__(self, filename, sample=1, buffer_size=1 << 16):
+        TraceSink.__init__(self, sample)
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC)
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+        self.var_num = dict()
+
+    def start(self, csp):
+        TraceSink.start(self, csp)
+        self.var_num = dict((var, i) for i, var in enumerate(csp.vars))
+        text = json.dumps({'csp': csp.name,
+                           'vars': [[var.name, var.dom] for var in csp.vars]}).encode('utf-8')
+        #a start record holds the length of the JSON header following it
+        self.buffer += RECORD.pack(KIND_CODES['start'], 0, 0, len(text))
+        self.buffer += text
+
+    def write(self, kind, level, var, value):
+        if var is None:
+            num = pos = -1
+        else:
+            num = self.var_num[var]
+            pos = -1 if value is None else var.dom_index[value]
+        self.buffer += RECORD.pack(KIND_CODES[kind], level, num, pos)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+
+    def finish(self):
+        self.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def read_trace(filename):
+    '''Generate the events of a trace file written by JSONLinesTrace or
+       BinaryTrace as (kind, level, variable name, value) tuples'''
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            f.seek(0)
+            for line in f:
+                event = json.loads(line)
+                if event['event'] == 'start':
+                    yield 'start', 0, event['csp'], None
+                else:
+                    yield event['event'], event['level'], event.get('var'), event.get('value')
+            return
+        vars = []
+        while True:
+            record = f.read(RECORD.size)
+            if len(record) < RECORD.size:
+                return
+            code, level, num, pos = RECORD.unpack(record)
+            kind = KINDS[code]
+            if kind == 'start':
+                header = json.loads(f.read(pos).decode('utf-8'))
+                vars = header['vars']
+                yield 'start', 0, header['csp'], None
+                continue
+            name = value = None
+            if num >= 0:
+                name, dom = vars[num]
+                if pos >= 0:
+                    value = dom[pos]
+            yield kind, level, name, value
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    for filename in argv:
+        counts = dict()
+        depth = 0
+        for kind, level, name, value in read_trace(filename):
+            counts[kind] = counts.get(kind, 0) + 1
+            depth = max(depth, level)
+        print(filename, ", ".join("{} {}".format(counts.get(kind, 0), kind) for kind in KINDS),
+              "max level", depth)
+
+
+if __name__ == "__main__":
+    main()
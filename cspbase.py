@@ -1,5 +1,13 @@
 import time
+import random
 import functools
+import itertools
+import weakref
+
+try:
+    import numpy
+except ImportError:
+    numpy = None    #only needed by ArrayConstraint
 
 '''Constraint Satisfaction Routines
    A) class Variable
@@ -28,7 +36,17 @@ import functools
       Once initialized the constraint can be incrementally initialized
       with a list of satisfying tuples. Each tuple specifies a value
       for each variable in the constraint (in the same ORDER as the
-      variables of the constraint were specified).
+      variables of the constraint were specified). Constraints with the
+      same relation over the same domains can share one Relation
+      object (see get_relation) instead of each holding the tuples.
+
+      class FunctionConstraint is a Constraint whose satisfying tuples
+      are given intensionally by a check function (and optionally a
+      specialized support function) instead of a table, for relations
+      whose tables would be too large to enumerate. class ArrayConstraint
+      keeps its table in numpy arrays (numpy is optional and only
+      needed for this class). class AllDifferent
+      is a global all-different constraint with its own GAC filtering.
 
     C) Backtracking routine---takes propagator and CSP as arguments
        so that basic backtracking, forward-checking or GAC can be 
@@ -45,8 +63,10 @@ class Variable:
 
        The variable object offers two types of functionality to support
        search. 
-       (a) It has a current domain, implimented as a set of flags 
-           determining which domain values are "current", i.e., unpruned.
+       (a) It has a current domain, implimented as an integer bitmask
+           (bit i set iff dom[i] is "current", i.e., unpruned) together
+           with a value --> bit index map, so membership tests, pruning
+           and counting do not need to search the domain list.
            - you can prune a value, and restore it.
            - you can obtain a list of values in the current domain, or count
              how many are still there
@@ -80,17 +100,32 @@ class Variable:
         string). Optionally specify the initial domain.
         '''
         self.name = name                #text name for variable
-        self.dom = list(domain)         #Make a copy of passed domain
-        self.curdom = [True] * len(domain)      #using list
+        self.dom = []                   #permanent domain, in order
+        self.dom_index = dict()         #value --> bit position in curdom
+        self.curdom = 0                 #bitmask, bit i set iff dom[i] is current
+        self.curdom_size = 0            #number of bits set in curdom
+        self.initdom = 0                #bitmask restore_curdom goes back to
+        self.add_domain_values(domain)
         #for bt_search
         self.assignedValue = None
+        self.trail = None               #undo stack prunings are recorded on
+        self.mrv = None                 #MRVBuckets holding this variable
+        self.cons_index = []            #(Constraint, position in its scope)
+                                        #for the constraints of CSPs over
+                                        #this variable, whose unassigned
+                                        #counts assign/unassign keep
 
     def add_domain_values(self, values):
         '''Add additional domain values to the domain
            Removals not supported removals'''
         for val in values: 
+            i = len(self.dom)
             self.dom.append(val)
-            self.curdom.append(True)
+            if not val in self.dom_index:
+                self.dom_index[val] = i
+                self.curdom |= 1 << i
+                self.curdom_size = self.curdom_size + 1
+                self.initdom |= 1 << i
 
     def domain_size(self):
         '''Return the size of the (permanent) domain'''
@@ -105,47 +140,93 @@ class Variable:
     #
 
     def prune_value(self, value):
-        '''Remove value from CURRENT domain'''
-        self.curdom[self.value_index(value)] = False
+        '''Remove value from CURRENT domain. If the variable is attached
+           to a trail (see CSP.set_trail) the pruning is recorded there
+           so that it can be undone on backtrack'''
+        bit = 1 << self.dom_index[value]
+        if self.curdom & bit:
+            self.curdom ^= bit
+            self.curdom_size = self.curdom_size - 1
+            if self.trail is not None:
+                self.trail.append((self, value))
+            if self.mrv is not None:
+                self.mrv.resize(self, self.curdom_size + 1)
 
     def unprune_value(self, value):
         '''Restore value to CURRENT domain'''
-        self.curdom[self.value_index(value)] = True
+        bit = 1 << self.dom_index[value]
+        if not self.curdom & bit:
+            self.curdom |= bit
+            self.curdom_size = self.curdom_size + 1
+            if self.mrv is not None:
+                self.mrv.resize(self, self.curdom_size - 1)
 
     def cur_domain(self):
         '''return list of values in CURRENT domain (if assigned 
            only assigned value is viewed as being in current domain)'''
-        vals = []
         if self.is_assigned():
-            vals.append(self.get_assigned_value())
-        else:
-            for i, val in enumerate(self.dom):
-                if self.curdom[i]:
-                    vals.append(val)
+            return [self.assignedValue]
+        vals = []
+        dom = self.dom
+        m = self.curdom
+        while m:
+            low = m & -m                #lowest set bit
+            vals.append(dom[low.bit_length() - 1])
+            m ^= low
         return vals
 
     def in_cur_domain(self, value):
         '''check if value is in CURRENT domain (without constructing list)
            if assigned only assigned value is viewed as being in current 
            domain'''
-        if not value in self.dom:
+        i = self.dom_index.get(value)
+        if i is None:
             return False
-        if self.is_assigned():
-            return value == self.get_assigned_value()
-        else:
-            return self.curdom[self.value_index(value)]
+        if self.assignedValue is not None:
+            return value == self.assignedValue
+        return (self.curdom >> i) & 1 == 1
 
     def cur_domain_size(self):
         '''Return the size of the variables domain (without construcing list)'''
-        if self.is_assigned():
+        if self.assignedValue is not None:
             return 1
-        else:
-            return(sum(1 for v in self.curdom if v))
+        return self.curdom_size
+
+    def cur_domain_mask(self):
+        '''Return the CURRENT domain as a bitmask over positions in the
+           domain list (if assigned only the assigned value's bit is set)'''
+        if self.assignedValue is not None:
+            return 1 << self.dom_index[self.assignedValue]
+        return self.curdom
 
     def restore_curdom(self):
-        '''return all values back into CURRENT domain'''
-        for i in range(len(self.curdom)):
-            self.curdom[i] = True
+        '''return all values back into CURRENT domain (all values of the
+           initial domain, see set_initial_domain)'''
+        old_size = self.curdom_size
+        self.curdom = self.initdom
+        self.curdom_size = bin(self.initdom).count("1")
+        if self.mrv is not None and old_size != self.curdom_size:
+            self.mrv.resize(self, old_size)
+
+    def set_initial_domain(self, values=None):
+        '''Restrict the values the CURRENT domain is restored to (e.g. by
+           bt_search before it starts) to those of values that are in
+           the domain, or to the whole domain if values is None, and
+           restore the current domain to them. Unlike building a new
+           variable this keeps the (permanent) domain and every
+           constraint over the variable as they are.'''
+        if values is None:
+            mask = 0
+            for i in self.dom_index.values():
+                mask |= 1 << i
+        else:
+            mask = 0
+            for val in values:
+                i = self.dom_index.get(val)
+                if i is not None:
+                    mask |= 1 << i
+        self.initdom = mask
+        self.restore_curdom()
 
     #
     #methods for assigning and unassigning
@@ -157,7 +238,8 @@ class Variable:
     def assign(self, value):
         '''Used by bt_search. When we assign we remove all other values
            values from curdom. We save this information so that we can
-           reverse it on unassign'''
+           reverse it on unassign. The unassigned counts of the
+           constraints over the variable are updated.'''
 
         if self.is_assigned() or not self.in_cur_domain(value):
             print("ERROR: trying to assign variable", self, 
@@ -165,6 +247,9 @@ class Variable:
             return
 
         self.assignedValue = value
+        for c, i in self.cons_index:
+            c.n_unasgn = c.n_unasgn - 1
+            c.unasgn_sum = c.unasgn_sum - i
 
     def unassign(self):
         '''Used by bt_search. Unassign and restore old curdom'''
@@ -172,6 +257,9 @@ class Variable:
             print("ERROR: trying to unassign variable", self, " not yet assigned")
             return
         self.assignedValue = None
+        for c, i in self.cons_index:
+            c.n_unasgn = c.n_unasgn + 1
+            c.unasgn_sum = c.unasgn_sum + i
 
     def get_assigned_value(self):
         '''return assigned value...returns None if is unassigned'''
@@ -183,8 +271,9 @@ class Variable:
 
     def value_index(self, value):
         '''Domain values need not be numbers, so return the index
-           in the domain list of a variable value'''
-        return self.dom.index(value)
+           in the domain list of a variable value (this is also its
+           bit position in curdom)'''
+        return self.dom_index[value]
 
     def __repr__(self):
         return("Var-{}".format(self.name))
@@ -196,7 +285,7 @@ class Variable:
         '''Also print the variable domain and current domain'''
         print("Var--\"{}\": Dom = {}, CurDom = {}".format(self.name, 
                                                              self.dom, 
-                                                             self.curdom))
+                                                             self.cur_domain()))
 class Constraint: 
     '''Class for defining constraints variable objects specifes an
        ordering over variables.  This ordering is used when calling
@@ -207,7 +296,8 @@ class Constraint:
         '''create a constraint object, specify the constraint name (a
         string) and its scope (an ORDERED list of variable objects).
         The order of the variables in the scope is critical to the
-        functioning of the constraint.
+        functioning of the constraint. A variable may appear in the
+        scope only once (ValueError otherwise).
 
         Consraints are implemented as storing a set of satisfying
         tuples (i.e., each tuple specifies a value for each variable
@@ -221,27 +311,63 @@ class Constraint:
 
         self.scope = list(scope)
         self.name = name
-        self.sat_tuples = dict()
-
-        #The next object data item 'sup_tuples' will be used to help
-        #support GAC propgation. It allows access to a list of 
-        #satisfying tuples that contain a particular variable/value
-        #pair.
-        self.sup_tuples = dict()
+        self.position = dict()  #variable --> its index in scope
+        for i, var in enumerate(self.scope):
+            if var in self.position:
+                raise ValueError("variable {} appears twice in the scope of constraint {}".format(
+                    var.name, name))
+            self.position[var] = i
+
+        #Once the constraint is added to a CSP its scope variables keep
+        #these up to date as they are assigned and unassigned (see
+        #CSP.add_constraint): the number of unassigned variables, and
+        #the sum of their positions in scope, which is the position of
+        #the last one when only one is left.
+        self.indexed = False
+        self.n_unasgn = 0
+        self.unasgn_sum = 0
+
+        #The satisfying tuples are held by a Relation object, which
+        #may be shared with other constraints (see get_relation).
+        #'sat_tuples' and 'sup_tuples' are the relation's tables;
+        #'sup_tuples' will be used to help support GAC propgation. It
+        #allows access to a list of satisfying tuples that contain a
+        #particular value at a particular scope position, i.e.,
+        #sup_tuples[(i, val)] for variable scope[i].
+        self.set_relation(Relation())
+
+        #'residues' remembers, for each variable/value pair, the
+        #position in sup_tuples[(i,val)] of the last support found
+        #for it. has_support tries that tuple first (AC-3rm style).
+        #A residue is only ever a hint---it is revalidated before
+        #use---so it needs no restoring when search backtracks.
+        self.residues = dict()
+
+        #conflict weight for dom/wdeg variable ordering, bumped by the
+        #propagators each time the constraint fails (wipes out a domain)
+        self.weight = 1
+
+        #Compact-Table state, built on first use by ct_filter.
+        self.CT = False         #filter with ct_filter inside prop_GAC
+        self.ct_ntuples = -1    #len(sat_tuples) the state was built for
+        self.ct_supports = None #ct_supports[i][b]: tuples with scope[i] = dom[b]
+        self.ct_stack = []      #(valid tuples, domain masks) states, see ct_filter
 
     def add_satisfying_tuples(self, tuples):
-        '''We specify the constraint by adding its complete list of satisfying tuples.'''
-        for x in tuples:
-            t = tuple(x)  #ensure we have an immutable tuple
-            if not t in self.sat_tuples:
-                self.sat_tuples[t] = True
-
-            #now put t in as a support for all of the variable values in it
-            for i, val in enumerate(t):
-                var = self.scope[i]
-                if not (var,val) in self.sup_tuples:
-                    self.sup_tuples[(var,val)] = []
-                self.sup_tuples[(var,val)].append(t)
+        '''We specify the constraint by adding its complete list of satisfying tuples.
+           If the constraint's relation is shared it is copied first.'''
+        if self.relation.shared:
+            self.set_relation(Relation(self.sat_tuples))
+        self.relation.add_tuples(tuples)
+
+    def set_relation(self, relation):
+        '''Make relation (a Relation, e.g. a shared one obtained from
+           get_relation) the table of satisfying tuples of the constraint'''
+        self.relation = relation
+        self.sat_tuples = relation.sat_tuples
+        self.sup_tuples = relation.sup_tuples
+        self.residues = dict()
+        self.ct_ntuples = -1
 
     def get_scope(self):
         '''get list of variables the constraint is over'''
@@ -258,6 +384,8 @@ class Constraint:
 
     def get_n_unasgn(self):
         '''return the number of unassigned variables in the constraint's scope'''
+        if self.indexed:
+            return self.n_unasgn
         n = 0
         for v in self.scope:
             if not v.is_assigned():
@@ -266,22 +394,64 @@ class Constraint:
 
     def get_unasgn_vars(self): 
         '''return list of unassigned variables in constraint's scope. Note
-           more expensive to get the list than to then number'''
+           more expensive to get the list than to then number (unless
+           at most one is left)'''
+        if self.indexed and self.n_unasgn <= 1:
+            if self.n_unasgn == 0:
+                return []
+            return [self.scope[self.unasgn_sum]]
         vs = []
         for v in self.scope:
             if not v.is_assigned():
                 vs.append(v)
         return vs
 
+    def get_last_unasgn_var(self):
+        '''return the only unassigned variable in the constraint's scope,
+           or None if there is not exactly one'''
+        if self.indexed:
+            if self.n_unasgn == 1:
+                return self.scope[self.unasgn_sum]
+            return None
+        vs = self.get_unasgn_vars()
+        if len(vs) == 1:
+            return vs[0]
+        return None
+
+    def index_unasgn(self):
+        '''Internal routine. Count the unassigned variables of the scope
+           and have them keep the count up to date from now on (called
+           by CSP.add_constraint)'''
+        if self.indexed:
+            return
+        self.n_unasgn = 0
+        self.unasgn_sum = 0
+        for i, var in enumerate(self.scope):
+            if not var.is_assigned():
+                self.n_unasgn = self.n_unasgn + 1
+                self.unasgn_sum = self.unasgn_sum + i
+            var.cons_index.append((self, i))
+        self.indexed = True
+
     def has_support(self, var, val):
         '''Test if a variable value pair has a supporting tuple (a set
            of assignments satisfying the constraint where each value is
            still in the corresponding variables current domain
+
+           The scan starts at the residue (last support found) and
+           wraps around the list, so every tuple is still tried once.
         '''
-        if (var, val) in self.sup_tuples:
-            for t in self.sup_tuples[(var, val)]:
-                if self.tuple_is_valid(t):
-                    return True
+        tuples = self.sup_tuples.get((self.position.get(var), val))
+        if tuples is None:
+            return False
+        n = len(tuples)
+        start = self.residues.get((var, val), 0)
+        for i in range(start, start + n):
+            if i >= n:
+                i = i - n
+            if self.tuple_is_valid(tuples[i]):
+                self.residues[(var, val)] = i
+                return True
         return False
 
     def tuple_is_valid(self, t):
@@ -292,9 +462,516 @@ class Constraint:
                 return False
         return True
 
+    def filter_domains(self):
+        '''Hook for constraints with their own GAC filtering algorithm
+           (see AllDifferent). Such constraints return
+           (True/False, [(Variable, Value), ...]): False if the
+           constraint cannot be satisfied from the current domains,
+           otherwise the list of current values that have no support.
+           Returns None for constraints that are to be filtered value
+           by value with has_support.
+
+           Table constraints switched to Compact-Table with
+           compact_table_on are filtered by ct_filter.'''
+        if self.CT:
+            return self.ct_filter()
+        return None
+
+    def compact_table_on(self):
+        '''Have prop_GAC filter this constraint with ct_filter'''
+        self.CT = True
+
+    def compact_table_off(self):
+        '''Have prop_GAC filter this constraint with has_support'''
+        self.CT = False
+
+    def ct_build(self):
+        '''Internal routine. Number the satisfying tuples and build, for
+           each scope position i and domain position b, the bitset
+           ct_supports[i][b] of tuples giving scope[i] the value dom[b]'''
+        self.ct_supports = []
+        for var in self.scope:
+            self.ct_supports.append([0] * len(var.dom))
+        for k, t in enumerate(self.sat_tuples):
+            bit = 1 << k
+            for i, var in enumerate(self.scope):
+                b = var.dom_index.get(t[i])
+                if b is not None:
+                    self.ct_supports[i][b] |= bit
+        self.ct_ntuples = len(self.sat_tuples)
+        self.ct_stack = []
+
+    def ct_filter(self):
+        '''Compact-Table filtering. ct_stack holds the states of the
+           table along the current search path: pairs (curr, masks) of
+           the bitset curr of tuples valid for the domain masks masks,
+           the domains shrinking up the stack. When search backtracks
+           (values come back), the states whose domains no longer
+           contain the current ones are popped, which restores the
+           state the table had at that point of the path; it is only
+           recomputed from scratch when none is left. From that state
+           curr is updated by masking out the supports of the removed
+           values (or intersecting with those of the remaining ones,
+           whichever is fewer) and the new state is pushed. A value is
+           supported iff its support bitset meets curr. Returns the
+           same (status, unsupported) pair as filter_domains.'''
+        if self.ct_ntuples != len(self.sat_tuples):
+            self.ct_build()
+        supports = self.ct_supports
+        masks = [var.cur_domain_mask() for var in self.scope]
+        stack = self.ct_stack
+        while stack:
+            last = stack[-1][1]
+            for i, m in enumerate(masks):
+                if m & ~last[i]:
+                    break
+            else:
+                break
+            stack.pop()
+        if not stack:
+            curr = (1 << self.ct_ntuples) - 1
+            for i, m in enumerate(masks):
+                curr &= bitset_union(supports[i], m)
+            stack.append((curr, masks))
+        else:
+            curr, last = stack[-1]
+            changed = False
+            for i, m in enumerate(masks):
+                removed = last[i] & ~m
+                if removed:
+                    changed = True
+                    if bin(removed).count("1") <= bin(m).count("1"):
+                        curr &= ~bitset_union(supports[i], removed)
+                    else:
+                        curr &= bitset_union(supports[i], m)
+            if changed:
+                stack.append((curr, masks))
+        if curr == 0:
+            return False, []
+
+        unsupported = []
+        for i, var in enumerate(self.scope):
+            if var.is_assigned():
+                continue
+            m = masks[i]
+            while m:
+                low = m & -m
+                b = low.bit_length() - 1
+                if not supports[i][b] & curr:
+                    unsupported.append((var, var.dom[b]))
+                m ^= low
+        return True, unsupported
+
     def __str__(self):
         return("{}({})".format(self.name,[var.name for var in self.scope]))
 
+class Relation:
+    '''The satisfying tuples of a table constraint, independent of the
+       variables it is applied to: sat_tuples holds the tuples and
+       sup_tuples[(i, val)] lists those with value val at position i.
+
+       A relation obtained from get_relation is shared by every
+       constraint built with the same signature, and must not be
+       changed; Constraint.add_satisfying_tuples copies it first.'''
+
+    def __init__(self, tuples=[]):
+        self.sat_tuples = dict()
+        self.sup_tuples = dict()
+        self.shared = False
+        self.add_tuples(tuples)
+
+    def add_tuples(self, tuples):
+        for x in tuples:
+            t = tuple(x)  #ensure we have an immutable tuple
+            if t in self.sat_tuples:
+                continue
+            self.sat_tuples[t] = True
+
+            #now put t in as a support for all of the values in it
+            for i, val in enumerate(t):
+                if not (i,val) in self.sup_tuples:
+                    self.sup_tuples[(i,val)] = []
+                self.sup_tuples[(i,val)].append(t)
+
+#signature --> shared Relation. Weak, so a relation is dropped once no
+#constraint uses it and long running processes building many models
+#(e.g. the sudoku_batch workers) do not accumulate them.
+RELATIONS = weakref.WeakValueDictionary()
+
+def get_relation(signature, make_tuples):
+    '''Return the shared Relation for signature, building it from the
+       tuples returned by make_tuples() the first time it is asked for.
+       The signature is any hashable value that determines the tuples,
+       typically a name for the relation together with the domains of
+       the scope, e.g. ("!=", (1, 2, 3), (1, 2, 3)).'''
+    relation = RELATIONS.get(signature)
+    if relation is None:
+        relation = Relation(make_tuples())
+        relation.shared = True
+        RELATIONS[signature] = relation
+    return relation
+
+def clear_relations():
+    '''Forget all shared relations (constraints using them keep them)'''
+    RELATIONS.clear()
+
+def bitset_union(sets, mask):
+    '''Return the union of the bitsets sets[b] over the bits b set
+       in mask'''
+    u = 0
+    while mask:
+        low = mask & -mask
+        u |= sets[low.bit_length() - 1]
+        mask ^= low
+    return u
+
+class FunctionConstraint(Constraint):
+    '''Constraint defined by a function rather than a table of
+       satisfying tuples, so nothing is materialized.
+
+       check_fn(vals) is given a list of values, one for each variable
+       of the scope (in scope order), and returns True iff they satisfy
+       the constraint.
+
+       support_fn(cons, var, val), if given, returns True iff var=val
+       has a supporting tuple over the current domains of the other
+       variables in the scope. Otherwise has_support enumerates the
+       current domains of the other variables and tests each tuple with
+       check_fn, which is only practical for small scopes.'''
+
+    def __init__(self, name, scope, check_fn, support_fn=None):
+        Constraint.__init__(self, name, scope)
+        self.check_fn = check_fn
+        self.support_fn = support_fn
+
+    def add_satisfying_tuples(self, tuples):
+        print("ERROR: trying to add satisfying tuples to function constraint", self)
+
+    def check(self, vals):
+        return self.check_fn(list(vals))
+
+    def has_support(self, var, val):
+        if not var.in_cur_domain(val):
+            return False
+        if self.support_fn is not None:
+            return self.support_fn(self, var, val)
+        doms = []
+        for v in self.scope:
+            if v is var:
+                doms.append([val])
+            else:
+                doms.append(v.cur_domain())
+        for t in itertools.product(*doms):
+            if self.check_fn(list(t)):
+                return True
+        return False
+
+    def tuple_is_valid(self, t):
+        return Constraint.tuple_is_valid(self, t) and self.check_fn(list(t))
+
+    def ct_filter(self):
+        return None   #no table to filter with
+
+class ArrayConstraint(Constraint):
+    '''Table constraint whose satisfying tuples are stored in a numpy
+       array instead of dictionaries and lists of Python tuples.
+
+       table is a 2-D array with a row per tuple, holding for each
+       scope variable the position of its value in the variable's
+       domain list (the smallest unsigned integer type that fits is
+       used, usually one byte per entry). For each column i and domain
+       position b, col_rows[i][b] is the array of rows giving scope[i]
+       the value dom[b].
+
+       Validity of tuples against the current domains is computed for
+       many rows at once: check and has_support look only at the rows
+       of one column value, and filter_domains (used by prop_GAC)
+       finds every unsupported value from a single pass over the
+       table. Requires numpy.'''
+
+    def __init__(self, name, scope):
+        if numpy is None:
+            raise ImportError("ArrayConstraint requires numpy")
+        Constraint.__init__(self, name, scope)
+        self.chunks = []        #row arrays added but not yet merged
+        self.table = None
+        self.col_rows = None
+        maxdom = max([len(var.dom) for var in self.scope] + [1])
+        if maxdom <= 1 << 8:
+            self.dtype = numpy.uint8
+        elif maxdom <= 1 << 16:
+            self.dtype = numpy.uint16
+        else:
+            self.dtype = numpy.uint32
+
+    def add_satisfying_tuples(self, tuples):
+        '''Add satisfying tuples (of values, in scope order). Tuples
+           with a value outside its variable's domain can never be
+           valid and are dropped.'''
+        rows = []
+        for t in tuples:
+            row = []
+            for i, var in enumerate(self.scope):
+                b = var.dom_index.get(t[i])
+                if b is None:
+                    break
+                row.append(b)
+            else:
+                rows.append(row)
+        if rows:
+            self.chunks.append(numpy.array(rows, dtype=self.dtype))
+            self.table = None
+
+    def build(self):
+        '''Internal routine. Merge the added rows into table (sorted,
+           without duplicates) and index its columns'''
+        arity = len(self.scope)
+        if self.chunks:
+            self.table = numpy.unique(numpy.concatenate(self.chunks), axis=0)
+        else:
+            self.table = numpy.zeros((0, arity), dtype=self.dtype)
+        self.chunks = [self.table]
+        self.col_rows = []
+        for i, var in enumerate(self.scope):
+            col = self.table[:, i]
+            order = numpy.argsort(col, kind="stable").astype(numpy.uint32)
+            bounds = numpy.searchsorted(col[order], numpy.arange(len(var.dom) + 1))
+            self.col_rows.append([order[bounds[b]:bounds[b + 1]]
+                                  for b in range(len(var.dom))])
+
+    def n_tuples(self):
+        if self.table is None:
+            self.build()
+        return len(self.table)
+
+    def domain_flags(self, var):
+        '''Internal routine. Boolean array over var's domain positions
+           marking the values in its CURRENT domain'''
+        m = var.cur_domain_mask()
+        return numpy.array([(m >> b) & 1 for b in range(len(var.dom))], dtype=bool)
+
+    def valid_rows(self, rows):
+        '''Internal routine. Boolean array marking which of the given
+           table rows are valid for the current domains'''
+        valid = numpy.ones(len(rows), dtype=bool)
+        for j, var in enumerate(self.scope):
+            valid &= self.domain_flags(var)[rows[:, j]]
+        return valid
+
+    def check(self, vals):
+        if self.table is None:
+            self.build()
+        idx = []
+        for i, var in enumerate(self.scope):
+            b = var.dom_index.get(vals[i])
+            if b is None:
+                return False
+            idx.append(b)
+        rows = self.table[self.col_rows[0][idx[0]]]
+        return bool((rows == numpy.array(idx, dtype=self.dtype)).all(axis=1).any())
+
+    def has_support(self, var, val):
+        if not var.in_cur_domain(val):
+            return False
+        if self.table is None:
+            self.build()
+        i = self.scope.index(var)
+        rows = self.table[self.col_rows[i][var.dom_index[val]]]
+        return bool(self.valid_rows(rows).any())
+
+    def filter_domains(self):
+        if self.table is None:
+            self.build()
+        live = self.table[self.valid_rows(self.table)]
+        if len(live) == 0:
+            return False, []
+        unsupported = []
+        for j, var in enumerate(self.scope):
+            if var.is_assigned():
+                continue
+            supported = numpy.bincount(live[:, j], minlength=len(var.dom))
+            for val in var.cur_domain():
+                if not supported[var.dom_index[val]]:
+                    unsupported.append((var, val))
+        return True, unsupported
+
+    def ct_filter(self):
+        return self.filter_domains()
+
+class AllDifferent(Constraint):
+    '''Global constraint requiring the variables of its scope to take
+       pairwise different values. Nothing is tabulated: check compares
+       values directly and filter_domains enforces GAC with Regin's
+       matching algorithm.
+
+       A value is supported iff its variable-value edge belongs to some
+       maximum matching of the scope onto values. Given one maximum
+       matching M, orient matched edges variable --> value and the
+       other edges value --> variable. An unmatched edge is then in
+       some maximum matching iff its value is reachable from a value
+       free in M, or both its ends lie in the same strongly connected
+       component. This gives every unsupported value at once, in time
+       linear in the number of edges after matching.'''
+
+    def __init__(self, name, scope):
+        Constraint.__init__(self, name, scope)
+        #last maximum matching found, var --> value. Only used as a
+        #starting point for the next one, so it needs no restoring on
+        #backtrack.
+        self.matching = dict()
+
+    def add_satisfying_tuples(self, tuples):
+        print("ERROR: trying to add satisfying tuples to all-different constraint", self)
+
+    def ct_filter(self):
+        return self.filter_domains()
+
+    def check(self, vals):
+        return len(set(vals)) == len(vals)
+
+    def has_support(self, var, val):
+        '''var=val is supported iff the rest of the scope can be
+           matched to distinct current values other than val'''
+        if not var.in_cur_domain(val):
+            return False
+        mate = dict()
+        owner = dict()
+        for v in self.scope:
+            if v is not var and not self.augment(v, mate, owner, val):
+                return False
+        return True
+
+    def augment(self, var, mate, owner, banned=None):
+        '''Extend the matching (mate: var --> value, owner: value --> var)
+           to cover var by a breadth first search for an augmenting path
+           that avoids value banned. Returns False if there is none.'''
+        parent = dict() #value --> variable it was reached from
+        frontier = [var]
+        while frontier:
+            next_frontier = []
+            for x in frontier:
+                for d in x.cur_domain():
+                    if d in parent or d == banned:
+                        continue
+                    parent[d] = x
+                    y = owner.get(d)
+                    if y is not None:
+                        next_frontier.append(y)
+                        continue
+                    #d is free, flip the path back to var
+                    while True:
+                        x = parent[d]
+                        prev = mate.get(x)
+                        mate[x] = d
+                        owner[d] = x
+                        if prev is None:
+                            return True
+                        d = prev
+            frontier = next_frontier
+        return False
+
+    def filter_domains(self):
+        scope = self.scope
+        mate = dict()
+        owner = dict()
+        for x in scope:
+            d = self.matching.get(x)
+            if d is not None and not d in owner and x.in_cur_domain(d):
+                mate[x] = d
+                owner[d] = x
+        for x in scope:
+            if not x in mate and not self.augment(x, mate, owner):
+                return False, []
+        self.matching = mate
+
+        #graph nodes: variables are 0..n-1, values n, n+1, ...
+        n = len(scope)
+        doms = []
+        node = dict()
+        for x in scope:
+            dom = x.cur_domain()
+            doms.append(dom)
+            for d in dom:
+                if not d in node:
+                    node[d] = n + len(node)
+        succ = [[] for i in range(n + len(node))]
+        free = []
+        for i, x in enumerate(scope):
+            succ[i].append(node[mate[x]])
+            for d in doms[i]:
+                if d != mate[x]:
+                    succ[node[d]].append(i)
+        for d, k in node.items():
+            if not d in owner:
+                free.append(k)
+
+        reached = [False] * len(succ)
+        stack = free
+        for k in free:
+            reached[k] = True
+        while stack:
+            k = stack.pop()
+            for j in succ[k]:
+                if not reached[j]:
+                    reached[j] = True
+                    stack.append(j)
+
+        comp = strongly_connected_components(succ)
+        unsupported = []
+        for i, x in enumerate(scope):
+            for d in doms[i]:
+                k = node[d]
+                if d != mate[x] and not reached[k] and comp[k] != comp[i]:
+                    unsupported.append((x, d))
+        return True, unsupported
+
+def strongly_connected_components(succ):
+    '''Tarjan's algorithm without recursion. succ[k] lists the
+       successors of node k; returns a list giving each node the number
+       of its strongly connected component'''
+    n = len(succ)
+    index = [-1] * n
+    low = [0] * n
+    comp = [-1] * n
+    on_stack = [False] * n
+    stack = []
+    counter = 0
+    ncomp = 0
+    for root in range(n):
+        if index[root] >= 0:
+            continue
+        work = [(root, 0)]
+        while work:
+            k, i = work.pop()
+            if i == 0:
+                index[k] = low[k] = counter
+                counter = counter + 1
+                stack.append(k)
+                on_stack[k] = True
+            else:
+                j = succ[k][i - 1]
+                if low[j] < low[k]:
+                    low[k] = low[j]
+            while i < len(succ[k]):
+                j = succ[k][i]
+                i = i + 1
+                if index[j] < 0:
+                    work.append((k, i))
+                    work.append((j, 0))
+                    break
+                if on_stack[j] and index[j] < low[k]:
+                    low[k] = index[j]
+            else:
+                if low[k] == index[k]:
+                    while True:
+                        j = stack.pop()
+                        on_stack[j] = False
+                        comp[j] = ncomp
+                        if j == k:
+                            break
+                    ncomp = ncomp + 1
+    return comp
+
 class CSP:
     '''Class for packing up a set of variables into a CSP problem.
        Contains various utility routines for accessing the problem.
@@ -309,6 +986,12 @@ class CSP:
         self.vars = []
         self.cons = []
         self.vars_to_cons = dict()
+        self.trail = None
+        self.profile = None     #csp_profile.Profile gathering statistics
+        self.conflicts = None   #ConflictSets the propagators report to
+                                #while BT searches with backjumping
+        self.budget = None      #BT whose time limits the propagators
+                                #check (see BT.check_budget)
         for v in vars:
             self.add_var(v)
 
@@ -322,11 +1005,12 @@ class CSP:
         else:
             self.vars.append(v)
             self.vars_to_cons[v] = []
+            v.trail = self.trail
 
     def add_constraint(self,c):
         '''Add constraint to CSP. Note that all variables in the 
            constraints scope must already have been added to the CSP'''
-        if not type(c) is Constraint:
+        if not isinstance(c, Constraint):
             print("Trying to add non constraint ", c, " to CSP object")
         else:
             for v in c.scope:
@@ -335,6 +1019,7 @@ class CSP:
                     return
                 self.vars_to_cons[v].append(c)
             self.cons.append(c)
+            c.index_unasgn()
 
     def get_all_cons(self):
         '''return list of all constraints in the CSP'''
@@ -348,6 +1033,15 @@ class CSP:
         '''return list of variables in the CSP'''
         return list(self.vars)
 
+    def set_trail(self, trail):
+        '''Attach an undo stack (a list) to the CSP and all of its
+           variables. While attached every Variable.prune_value appends
+           (Variable, Value) to it, so propagators need not return
+           pruning lists. Pass None to detach.'''
+        self.trail = trail
+        for v in self.vars:
+            v.trail = trail
+
     def print_all(self):
         print("CSP", self.name)
         print("   Variables = ", self.vars)
@@ -360,6 +1054,244 @@ class CSP:
             print(v, " = ", v.get_assigned_value(), "    ", end='')
         print("")
 
+class MRVBuckets:
+    '''Bucket queue of unassigned variables keyed on current domain
+       size, used by BT to find a minimum remaining values variable
+       without scanning all unassigned variables.
+
+       Every variable in the queue points back to it (Variable.mrv),
+       so prune_value/unprune_value move the variable between buckets
+       as its domain size changes. Within a bucket variables are kept
+       in insertion order, so ties go to the variable that has been
+       waiting longest.'''
+
+    def __init__(self, vars=[]):
+        self.buckets = [dict()]     #buckets[k] = {var: None} for size k
+        self.min_size = 0           #no nonempty bucket below this
+        self.n = 0
+        for v in vars:
+            self.insert(v)
+
+    def __len__(self):
+        return self.n
+
+    def insert(self, var):
+        '''Add an (unassigned) variable to the queue'''
+        size = var.curdom_size
+        while len(self.buckets) <= len(var.dom):
+            self.buckets.append(dict())
+        self.buckets[size][var] = None
+        if self.n == 0 or size < self.min_size:
+            self.min_size = size
+        self.n = self.n + 1
+        var.mrv = self
+
+    def resize(self, var, old_size):
+        '''Move var from the bucket for old_size to the one for its
+           current domain size'''
+        del self.buckets[old_size][var]
+        size = var.curdom_size
+        self.buckets[size][var] = None
+        if size < self.min_size:
+            self.min_size = size
+
+    def extract_min(self, rng=None):
+        '''Remove and return a variable with minimum current domain
+           size (None if the queue is empty). Ties are broken at random
+           with rng (a random.Random) if it is given.'''
+        if self.n == 0:
+            return None
+        size = self.min_size
+        while not self.buckets[size]:
+            size = size + 1
+        self.min_size = size
+        bucket = self.buckets[size]
+        if rng is None:
+            var = next(iter(bucket))
+        else:
+            var = rng.choice(list(bucket))
+        del bucket[var]
+        self.n = self.n - 1
+        var.mrv = None
+        return var
+
+    def clear(self):
+        '''Empty the queue, detaching all variables from it'''
+        for bucket in self.buckets:
+            for var in bucket:
+                var.mrv = None
+            bucket.clear()
+        self.min_size = 0
+        self.n = 0
+
+class ConflictSets:
+    '''Explanations of the prunings and failures of a search, used by
+       BT for conflict-directed backjumping (see BT.cbj_on). A conflict
+       set is a bitmask of search levels, bit L standing for the
+       assignment made at level L.
+
+       While BT searches with backjumping the CSP's conflicts attribute
+       is one of these, and the propagators report to it:
+          pruned(var, val, reason)  val of var was pruned because of
+                                    the assignments in reason
+          failed(C)                 constraint C failed (wiped out a
+                                    domain, or a fully assigned C was
+                                    falsified)
+       reason(C, var) is the reason for a pruning done by C: the levels
+       responsible for the current domains of C's other variables.
+       Prunings that are not reported are blamed on every level so far,
+       and so is a failure that is not, so any propagator is correct
+       with backjumping; reporting only makes the jumps longer.'''
+
+    def __init__(self):
+        self.levels = dict()    #assigned variable --> its level
+        self.reasons = dict()   #(Variable, Value) pruned --> conflict set
+        self.conflict = None    #conflict set of the last failure
+
+    def explain(self, var):
+        '''Return the conflict set responsible for var's current domain:
+           the level of its assignment, or the reasons of the values
+           pruned from it'''
+        if var.assignedValue is not None:
+            level = self.levels.get(var)
+            return 0 if level is None else 1 << level
+        mask = 0
+        reasons = self.reasons
+        dom = var.dom
+        m = var.initdom & ~var.curdom
+        while m:
+            low = m & -m
+            mask |= reasons.get((var, dom[low.bit_length() - 1]), 0)
+            m ^= low
+        return mask
+
+    def reason(self, C, var=None):
+        '''Return the conflict set of the variables of C other than var'''
+        mask = 0
+        for v in C.scope:
+            if v is not var:
+                mask |= self.explain(v)
+        return mask
+
+    def pruned(self, var, val, reason):
+        self.reasons[(var, val)] = reason
+
+    def failed(self, C):
+        self.conflict = self.reason(C)
+
+    def blame(self, trail, start, level):
+        '''Internal routine. Give the prunings trail[start:] (made at
+           level) that were not reported every level up to level as
+           their reason'''
+        mask = (1 << (level + 1)) - 2
+        reasons = self.reasons
+        for i in range(start, len(trail)):
+            if trail[i] not in reasons:
+                reasons[trail[i]] = mask
+
+    def forget(self, trail, start):
+        '''Internal routine. Drop the reasons of the prunings
+           trail[start:], which are being undone'''
+        reasons = self.reasons
+        for i in range(start, len(trail)):
+            reasons.pop(trail[i], None)
+
+def luby(i):
+    '''Return the i-th term (from 1) of the Luby sequence
+       1 1 2 1 1 2 4 1 1 2 1 1 2 4 8 ...'''
+    k = 1
+    while (1 << k) - 1 < i:
+        k = k + 1
+    while (1 << k) - 1 != i:
+        i = i - (1 << (k - 1)) + 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k = k + 1
+    return 1 << (k - 1)
+
+class TraceSink:
+    '''Receiver of the events of a BT search (see BT.trace_on). The
+       search calls
+          start(csp)                    when search begins
+          assign(level, var, val)       var = val is tried at level
+          prune(level, trail, start)    the prunings trail[start:] were
+                                        made propagating at level (0
+                                        for the initial propagation)
+          wipeout(level, var)           propagating var's value failed
+          backtrack(level, var)         all values of var tried
+          solution(level)               all variables are assigned
+          finish()                      when search ends
+       Subclasses implement write(kind, level, var, value), which gets
+       every event that is recorded, one pruning at a time (var and
+       value are None where they do not apply).
+
+       With sample=k only one search node in k is recorded: the assign
+       event of every k-th decision together with the prune, wipeout
+       and backtrack events that follow it. Solutions are always
+       recorded.'''
+
+    def __init__(self, sample=1):
+        self.sample = sample
+        self.nodes = 0
+        self.on = True      #record the events of the current node
+
+    def start(self, csp):
+        self.nodes = 0
+        self.on = True
+
+    def finish(self):
+        pass
+
+    def assign(self, level, var, val):
+        self.on = self.nodes % self.sample == 0
+        self.nodes = self.nodes + 1
+        if self.on:
+            self.write('assign', level, var, val)
+
+    def prune(self, level, trail, start):
+        if self.on:
+            for i in range(start, len(trail)):
+                var, val = trail[i]
+                self.write('prune', level, var, val)
+
+    def wipeout(self, level, var):
+        if self.on:
+            self.write('wipeout', level, var, None)
+
+    def backtrack(self, level, var):
+        if self.on:
+            self.write('backtrack', level, var, None)
+
+    def solution(self, level):
+        self.write('solution', level, None, None)
+
+    def write(self, kind, level, var, value):
+        pass
+
+class PrintTrace(TraceSink):
+    '''Trace printing every event, indented by search level'''
+
+    def start(self, csp):
+        TraceSink.start(self, csp)
+        print("Search of CSP", csp.name, "started")
+
+    def write(self, kind, level, var, value):
+        if var is None:
+            print('  ' * level, kind)
+        elif value is None:
+            print('  ' * level, kind, var)
+        else:
+            print('  ' * level, kind, var, "=", value)
+
+class SearchLimit(Exception):
+    '''Raised by BT.check_budget inside a propagator when the search
+       runs out of time or is stopped; limit is the name of the limit
+       reached'''
+
+    def __init__(self, limit):
+        Exception.__init__(self, limit)
+        self.limit = limit
+
 ########################################################
 # Backtracking Routine                                 #
 ########################################################
@@ -380,17 +1312,176 @@ class BT:
         self.nDecisions = 0 #nDecisions is the number of variable 
                             #assignments made during search
         self.nPrunings  = 0 #nPrunings is the number of value prunings during search
-        unasgn_vars = list() #used to track unassigned variables
-        self.TRACE = False
+        self.unasgn_vars = list() #used to track unassigned variables
+        self.trail = []     #undo stack of (Variable, Value) prunings; a
+                            #search level is marked by the trail length
+                            #when it started
+        self.trace = None       #TraceSink receiving search events
+        self.set_limits()
+        self.limit_reached = None   #name of the limit that stopped the
+                                    #last search, None if none did
+        self.open_nodes = None  #if a list, a search stopped by a limit
+                                #adds its unexplored subproblems to it
+        self.seed = None        #seed of rng, see set_random
+        self.rng = None         #random.Random breaking ties, reseeded
+                                #at the start of every search
+        self.set_heuristics()
+        self.use_buckets = True #unasgn_vars is an MRVBuckets queue
+        self.restarts = None    #(strategy, base, factor), see set_restarts
+        self.run_decisions = None   #nDecisions at which this run restarts
+        self.nogoods = None     #nogoods recorded at restarts
+        self.nogood_index = dict()  #variable --> nogoods mentioning it
+        self.MRV_SCAN = False   #select MRV variables by scanning a list
+                                #instead of using MRVBuckets
+        self.CBJ = False        #conflict-directed backjumping, see cbj_on
+        self.conflicts = None   #ConflictSets of the current search if CBJ
         self.runtime = 0
 
-    def trace_on(self):
-        '''Turn search trace on'''
-        self.TRACE = True
+    def trace_on(self, sink=None):
+        '''Turn search trace on: send the events of the search to sink
+           (a TraceSink, e.g. csp_trace.JSONLinesTrace), by default a
+           PrintTrace printing them'''
+        if sink is None:
+            sink = PrintTrace()
+        self.trace = sink
 
     def trace_off(self):
         '''Turn search trace off'''
-        self.TRACE = False
+        self.trace = None
+
+    def set_limits(self, time=None, cpu=None, decisions=None, prunings=None,
+                   stop=None):
+        '''Limit each search to time seconds of wall clock time, cpu
+           seconds of CPU time, decisions variable assignments and
+           prunings value prunings (None for no limit; with no arguments
+           all limits are removed). stop is an Event (e.g. a
+           multiprocessing.Event shared with other processes): setting
+           it stops the search. Limits are checked before every
+           decision on a variable with more than one value, and the time
+           limits and stop also while GAC propagates (see check_budget),
+           so a single long propagation cannot overrun them: a search
+           that reaches one stops, undoes all its
+           assignments and prunings and sets limit_reached to the name
+           of the limit ('time', 'cpu', 'decisions', 'prunings' or
+           'stop').
+           bt_search then reports status 'unknown'; solutions and
+           count_solutions just stop early. If open_nodes is a list the
+           unexplored part of the search tree is added to it as
+           subproblems (see save_open_nodes), which can be searched by
+           loading them with Variable.set_initial_domain.'''
+        self.max_time = time
+        self.max_cpu = cpu
+        self.max_decisions = decisions
+        self.max_prunings = prunings
+        self.stop = stop
+        self.limited = not (time is None and cpu is None and decisions is None
+                            and prunings is None and stop is None)
+
+    def set_random(self, seed=None):
+        '''Break ties between MRV variables, and order the values of
+           each variable, at random using a random.Random seeded with
+           seed. The generator is seeded again at the start of every
+           search, so searches with the same seed make the same choices.
+           Pass seed=None to go back to the deterministic orders.'''
+        self.seed = seed
+        if seed is None:
+            self.rng = None
+        else:
+            self.rng = random.Random(seed)
+
+    def set_restarts(self, strategy='luby', base=100, factor=1.5, seed=0, nogoods=True):
+        '''Restart search while looking for the first solution. Run k
+           stops after base * luby(k) decisions (strategy 'luby') or
+           base * factor**(k-1) decisions ('geometric') and search starts
+           again from the root; once a solution is found the run that
+           found it goes on without a cutoff. Tie breaking and value
+           order are randomized with set_random(seed), so runs differ
+           but are reproducible.
+
+           With nogoods, every value that a run had completely refuted
+           when it was stopped is recorded as a nogood: the decisions
+           above it together with that value. Later runs prune values
+           completing a nogood, so they never search those subtrees
+           again. Pass strategy=None to stop restarting.'''
+        if strategy is None:
+            self.restarts = None
+            return
+        if strategy not in ('luby', 'geometric'):
+            raise ValueError("unknown restart strategy {!r}".format(strategy))
+        self.restarts = (strategy, base, factor, nogoods)
+        self.set_random(seed)
+
+    def run_cutoff(self, run):
+        '''Internal routine. Decisions allowed to restart run number run
+           (counting from 1)'''
+        strategy, base, factor, nogoods = self.restarts
+        if strategy == 'luby':
+            return base * luby(run)
+        return int(base * factor ** (run - 1))
+
+    def check_limits(self):
+        '''Internal routine. Return the name of a limit the current
+           search has reached ('restart' for the cutoff of a restart
+           run), or None'''
+        if self.run_decisions is not None and self.nDecisions >= self.run_decisions:
+            return 'restart'
+        if self.max_decisions is not None and self.nDecisions >= self.max_decisions:
+            return 'decisions'
+        if self.max_prunings is not None and self.nPrunings >= self.max_prunings:
+            return 'prunings'
+        if self.max_time is not None and time.perf_counter() - self.start_wall >= self.max_time:
+            return 'time'
+        if self.max_cpu is not None and time.process_time() - self.start_cpu >= self.max_cpu:
+            return 'cpu'
+        if self.stop is not None and self.stop.is_set():
+            return 'stop'
+        return None
+
+    def check_budget(self):
+        '''Called by the propagators (through csp.budget) while they
+           work. Raises SearchLimit if the time or cpu limit has been
+           reached or stop is set'''
+        if self.max_time is not None and time.perf_counter() - self.start_wall >= self.max_time:
+            raise SearchLimit('time')
+        if self.max_cpu is not None and time.process_time() - self.start_cpu >= self.max_cpu:
+            raise SearchLimit('cpu')
+        if self.stop is not None and self.stop.is_set():
+            raise SearchLimit('stop')
+
+    def set_heuristics(self, var_order=None, val_order=None):
+        '''Choose the variable and value ordering heuristics (see
+           csp_heuristics). var_order(bt, vars) returns the variable of
+           the list of unassigned variables vars to branch on next;
+           None selects MRV. val_order(bt, var, vals) returns the values
+           vals of var in the order to try them; None keeps the domain
+           order.'''
+        self.var_order = var_order
+        self.val_order = val_order
+
+    def mrv_scan_on(self):
+        '''Select MRV variables by scanning every unassigned variable
+           (the original selector, kept for comparison)'''
+        self.MRV_SCAN = True
+
+    def mrv_scan_off(self):
+        '''Select MRV variables with an incremental MRVBuckets queue
+           (the default)'''
+        self.MRV_SCAN = False
+
+    def cbj_on(self):
+        '''Search with conflict-directed backjumping: when every value of
+           a variable has failed, back up directly to the deepest level
+           whose assignment is in the conflict set of the failures (as
+           explained by the propagators, see ConflictSets), undoing the
+           levels in between without trying their other values, which
+           cannot lead to a solution either. Works with any propagator;
+           prop_BT, prop_FC, prop_GAC and prop_CT explain their
+           failures, so they jump furthest.'''
+        self.CBJ = True
+
+    def cbj_off(self):
+        '''Back up one level at a time (the default)'''
+        self.CBJ = False
 
         
     def clear_stats(self):
@@ -398,10 +1489,23 @@ class BT:
         self.nDecisions = 0
         self.nPrunings = 0
         self.runtime = 0
+        self.limit_reached = None
+        self.nRestarts = 0
+        self.nNogoods = 0
+        self.nBackjumps = 0
+        self.nSkipped = 0
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
 
     def print_stats(self):
         print("Search made {} variable assignments and pruned {} variable values".format(
             self.nDecisions, self.nPrunings))
+        if self.nRestarts:
+            print("Search restarted {} times and recorded {} nogoods".format(
+                self.nRestarts, self.nNogoods))
+        if self.CBJ:
+            print("Search backjumped {} times, skipping {} levels".format(
+                self.nBackjumps, self.nSkipped))
 
     def restoreValues(self,prunings):
         '''Restore list of values to variable domains
@@ -409,6 +1513,16 @@ class BT:
         for var, val in prunings:
             var.unprune_value(val)
 
+    def restore_trail(self, marker):
+        '''Undo every pruning recorded on the trail since marker
+           (a previous length of the trail), latest first'''
+        trail = self.trail
+        if len(trail) > marker:
+            if self.conflicts is not None:
+                self.conflicts.forget(trail, marker)
+            self.restoreValues(reversed(trail[marker:]))
+            del trail[marker:]
+
     def restore_all_variable_domains(self):
         '''Reinitialize all variable domains'''
         for var in self.csp.vars:
@@ -417,26 +1531,46 @@ class BT:
             var.restore_curdom()
 
     def extractMRVvar(self):
-        '''Remove variable with minimum sized cur domain from list of
-           unassigned vars. Would be faster to use heap...but this is
-           not production code.
+        '''Remove variable with minimum sized cur domain from the
+           unassigned vars. Unless MRV_SCAN is on these are held in an
+           MRVBuckets queue kept up to date by pruning and unpruning;
+           otherwise we scan the whole list. Ties go to the variable
+           found first, or to a random one if set_random was used.
+           A variable ordering heuristic given to set_heuristics
+           replaces MRV.
         '''
+        if self.use_buckets:
+            return self.unasgn_vars.extract_min(self.rng)
+        if self.var_order is not None:
+            mv = self.var_order(self, self.unasgn_vars)
+            self.unasgn_vars.remove(mv)
+            return mv
 
         md = -1
         mv = None
+        ties = []
         for v in self.unasgn_vars:
             if md < 0:
                 md = v.cur_domain_size()
                 mv = v
+                ties = [v]
             elif v.cur_domain_size() < md:
                 md = v.cur_domain_size()
                 mv = v
+                ties = [v]
+            elif v.cur_domain_size() == md:
+                ties.append(v)
+        if self.rng is not None:
+            mv = self.rng.choice(ties)
         self.unasgn_vars.remove(mv)
         return mv
 
     def restoreUnasgnVar(self, var):
         '''Add variable back to list of unassigned vars'''
-        self.unasgn_vars.append(var)
+        if self.use_buckets:
+            self.unasgn_vars.insert(var)
+        else:
+            self.unasgn_vars.append(var)
         
     def bt_search(self,propagator):
         '''Try to solve the CSP using specified propagator routine
@@ -464,85 +1598,421 @@ class BT:
 
            The list of variable values pairs are all of the values
            the propagator pruned (using the variable's prune_value method). 
-           bt_search NEEDS to know this in order to correctly restore these 
-           values when it undoes a variable assignment.
+
+           During bt_search the CSP has the solver's trail attached (see
+           CSP.set_trail), so every prune_value call is recorded and
+           undone by popping the trail back to the level's marker. The
+           propagator may therefore return None instead of the list;
+           a returned list is accepted but not needed for restoration.
 
            NOTE propagator SHOULD NOT prune a value that has already been 
-           pruned! Nor should it prune a value twice'''
+           pruned! Nor should it prune a value twice
+
+           Returns 'solved' (the solution is left assigned), 'unsat', or
+           'unknown' if a limit set with set_limits stopped the search
+           (limit_reached tells which).'''
 
         self.clear_stats()
         stime = time.process_time()
+        if self.csp.profile is not None:
+            propagator = self.csp.profile.propagator(propagator)
+
+        try:
+            status = self.search_start(propagator)
+
+            if status == False:
+                if self.limit_reached is None:
+                    print("CSP{} detected contradiction at root".format(
+                        self.csp.name))
+            else:
+                status = self.bt_iterate(propagator)   #now do the search
+        except BaseException:
+            #leave no partial assignment behind either
+            for v in self.csp.vars:
+                if v.is_assigned():
+                    v.unassign()
+            raise
+        finally:
+            self.search_finish()
+        self.runtime = time.process_time() - stime
+        if self.limit_reached is not None:
+            print("CSP {} search stopped, {} limit reached. CPU Time used = {}".format(
+                self.csp.name, self.limit_reached, self.runtime))
+            status = 'unknown'
+        elif status == False:
+            print("CSP{} unsolved. Has no solutions".format(self.csp.name))
+            status = 'unsat'
+        else:
+            print("CSP {} solved. CPU Time used = {}".format(self.csp.name,
+                                                             self.runtime))
+            self.csp.print_soln()
+            status = 'solved'
 
+        print("bt_search finished")
+        self.print_stats()
+        return status
+
+    def solutions(self, propagator, limit=None):
+        '''Generator yielding the solutions of the CSP one at a time, each
+           as a dict {Variable: value}, using propagator as bt_search
+           does. Nothing is printed. Stops after limit solutions if
+           limit is given. When the generator finishes or is closed
+           all variables are unassigned and their domains restored.'''
+        for _ in self.search_all(propagator, limit):
+            soln = dict()
+            for v in self.csp.vars:
+                soln[v] = v.get_assigned_value()
+            yield soln
+
+    def count_solutions(self, propagator, limit=None):
+        '''Return the number of solutions of the CSP, counting no further
+           than limit if it is given (e.g. limit=2 to test whether a
+           sudoku has a unique solution). Nothing is printed.'''
+        n = 0
+        for _ in self.search_all(propagator, limit):
+            n = n + 1
+        return n
+
+    def search_all(self, propagator, limit=None):
+        '''Internal routine. Generator behind solutions and
+           count_solutions: yields (None) each time the variables hold a
+           new solution, at most limit times. Stops early if a limit set
+           with set_limits is reached (see limit_reached).'''
+        self.clear_stats()
+        stime = time.process_time()
+        if self.csp.profile is not None:
+            propagator = self.csp.profile.propagator(propagator)
+        try:
+            if self.search_start(propagator) and (limit is None or limit > 0):
+                n = 0
+                for _ in self.walk(propagator):
+                    n = n + 1
+                    yield
+                    if limit is not None and n >= limit:
+                        break
+        finally:
+            self.runtime = time.process_time() - stime
+            self.search_finish()
+            for v in self.csp.vars:
+                if v.is_assigned():
+                    v.unassign()
+
+    def search_start(self, propagator):
+        '''Internal routine. Reset all variables, set up the unassigned
+           variable queue, attach the trail and do the initial (root)
+           propagation. Returns the propagator's status.'''
         self.restore_all_variable_domains()
+        if self.seed is not None:
+            self.rng = random.Random(self.seed)
         
         self.unasgn_vars = []
         for v in self.csp.vars:
             if not v.is_assigned():
                 self.unasgn_vars.append(v)
-
-        status, prunings = propagator(self.csp) #initial propagate no assigned variables.
-        self.nPrunings = self.nPrunings + len(prunings)
-
-        if self.TRACE:
-            print(len(self.unasgn_vars), " unassigned variables at start of search")
-            print("Root Prunings: ", prunings)
-
-        if status == False:
-            print("CSP{} detected contradiction at root".format(
-                self.csp.name))
+        self.use_buckets = not self.MRV_SCAN and self.var_order is None
+        if self.use_buckets:
+            self.unasgn_vars = MRVBuckets(self.unasgn_vars)
+
+        self.trail = []
+        self.csp.set_trail(self.trail)
+        if self.CBJ:
+            self.conflicts = ConflictSets()
         else:
-            status = self.bt_recurse(propagator, 1)   #now do recursive search
-
-
-        self.restoreValues(prunings)
-        if status == False:
-            print("CSP{} unsolved. Has no solutions".format(self.csp.name))
-        if status == True:
-            print("CSP {} solved. CPU Time used = {}".format(self.csp.name,
-                                                             time.process_time() - stime))
-            self.csp.print_soln()
-
-        print("bt_search finished")
-        self.print_stats()
-
-    def bt_recurse(self, propagator, level):
-        '''Return true if found solution. False if still need to search.
-           If top level returns false--> no solution'''
-
-        if self.TRACE:
-            print('  ' * level, "bt_recurse level ", level)
-           
-        if not self.unasgn_vars:
-            #all variables assigned
-            return True
+            self.conflicts = None
+        self.csp.conflicts = self.conflicts
+        if self.trace is not None:
+            self.trace.start(self.csp)
+        self.nogood_index = dict()
+        if self.restarts is not None and self.restarts[3]:
+            self.nogoods = []
         else:
-            var = self.extractMRVvar()
-            if self.TRACE:
-                print('  ' * level, "bt_recurse var = ", var)
-
-            for val in var.cur_domain():
+            self.nogoods = None
+
+        if self.max_time is not None or self.max_cpu is not None or self.stop is not None:
+            self.csp.budget = self
+        try:
+            status, prunings = propagator(self.csp) #initial propagate no assigned variables.
+        except SearchLimit as e:
+            self.limit_reached = e.limit
+            self.restore_trail(0)
+            if self.open_nodes is not None:
+                self.open_nodes.append([v.cur_domain() for v in self.csp.vars])
+            return False
+        self.nPrunings = self.nPrunings + len(self.trail)
+
+        if self.trace is not None:
+            self.trace.prune(0, self.trail, 0)
+            if not status:
+                self.trace.wipeout(0, None)
+        return status
+
+    def search_finish(self):
+        '''Internal routine. Undo all prunings and detach the trail
+           (assignments are left as they are). Called however the search
+           ends, also when it raised, so it must not depend on how far
+           search_start got.'''
+        if isinstance(self.unasgn_vars, MRVBuckets):
+            self.unasgn_vars.clear()
+        self.restore_trail(0)
+        self.csp.set_trail(None)
+        self.csp.conflicts = self.conflicts = None
+        self.csp.budget = None
+        if self.trace is not None:
+            self.trace.finish()
+
+    def save_open_nodes(self, var, vals):
+        '''Internal routine. Add to open_nodes the subproblems var = val,
+           for val in vals, of the current search state: for each a list
+           giving the current domain of every variable of the csp (in
+           csp.vars order). Used when a limit stops search, so that the
+           subproblems together cover all of the unexplored tree.'''
+        doms = [v.cur_domain() for v in self.csp.vars]
+        k = self.csp.vars.index(var)
+        for val in vals:
+            node = list(doms)
+            node[k] = [val]
+            self.open_nodes.append(node)
+
+    def bt_iterate(self, propagator):
+        '''Search for a solution from the current state. Return True if
+           a solution was found (left assigned), False if there is none
+           (all assignments made here undone).'''
+        for _ in self.walk(propagator):
+            return True
+        return False
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse trying", var, "=", val)
+    def walk(self, propagator):
+        '''Internal routine. The search generator to use: bt_runs if
+           restarts are on, otherwise bt_walk'''
+        if self.restarts is not None:
+            return self.bt_runs(propagator)
+        return self.bt_walk(propagator)
+
+    def bt_runs(self, propagator):
+        '''Generator doing the runs of a restarting search (see
+           set_restarts) from the current state, yielding as bt_walk
+           does. After each run that is cut off, the nogoods it
+           recorded are used to prune the root before the next.'''
+        run = 0
+        while True:
+            run = run + 1
+            self.run_decisions = self.nDecisions + self.run_cutoff(run)
+            try:
+                for _ in self.bt_walk(propagator):
+                    yield
+            finally:
+                self.run_decisions = None
+            if self.limit_reached != 'restart':
+                return
+            self.limit_reached = None
+            self.nRestarts = self.nRestarts + 1
+            marker = len(self.trail)
+            status = True
+            if self.nogoods is not None:
+                status = self.nogood_prune_root()
+            if status and len(self.trail) > marker:
+                #propagate the values the nogoods pruned
+                try:
+                    status, prunings = propagator(self.csp)
+                except SearchLimit as e:
+                    #the whole remaining problem is left unexplored
+                    self.limit_reached = e.limit
+                    self.restore_trail(marker)
+                    if self.open_nodes is not None:
+                        self.open_nodes.append([v.cur_domain() for v in self.csp.vars])
+                    return
+            self.nPrunings = self.nPrunings + len(self.trail) - marker
+            if not status:
+                return
+
+    def add_nogood(self, nogood):
+        '''Internal routine. Record nogood, a list of (Variable, value)
+           assignments that cannot all hold in a solution'''
+        self.nogoods.append(nogood)
+        self.nNogoods = self.nNogoods + 1
+        for var, val in nogood:
+            if var in self.nogood_index:
+                self.nogood_index[var].append(nogood)
+            else:
+                self.nogood_index[var] = [nogood]
+
+    def nogood_prune_root(self):
+        '''Internal routine. Prune the values that single assignment
+           nogoods rule out. Returns False on a domain wipe out'''
+        for nogood in self.nogoods:
+            if len(nogood) == 1:
+                var, val = nogood[0]
+                if var.in_cur_domain(val) and not var.is_assigned():
+                    var.prune_value(val)
+                    if var.cur_domain_size() == 0:
+                        return False
+        return True
 
-                var.assign(val)
-                self.nDecisions = self.nDecisions+1
+    def nogood_propagate(self, var):
+        '''Internal routine. After var was assigned, fail if a nogood
+           over var is now fully assigned, and prune the last value of
+           every nogood over var with all but one assignment made.
+           Returns False on failure.'''
+        for nogood in self.nogood_index.get(var, ()):
+            last = None
+            for v, val in nogood:
+                if v.is_assigned():
+                    if v.get_assigned_value() != val:
+                        break
+                elif last is None:
+                    last = (v, val)
+                else:
+                    break
+            else:
+                if last is None:
+                    return False
+                v, val = last
+                if v.in_cur_domain(val):
+                    v.prune_value(val)
+                    if v.cur_domain_size() == 0:
+                        return False
+        return True
 
-                status, prunings = propagator(self.csp, var)
-                self.nPrunings = self.nPrunings + len(prunings)
+    def abandon(self, stack):
+        '''Internal routine. The search ran out of budget (the limit is
+           in limit_reached): undo the choice points of stack, recording
+           the nogoods a restart learns or the open nodes left
+           unexplored'''
+        restart = self.limit_reached == 'restart'
+        while stack:
+            var, vals, i, marker = stack.pop()
+            refuted = vals[:i]
+            if var.is_assigned():
+                refuted = vals[:i-1]
+                self.restore_trail(marker)
+                var.unassign()
+            if restart and self.nogoods is not None:
+                #the values refuted under the decisions above
+                decisions = [(c[0], c[1][c[2]-1]) for c in stack]
+                for val in refuted:
+                    self.add_nogood(decisions + [(var, val)])
+            elif self.open_nodes is not None:
+                self.save_open_nodes(var, vals[i:])
+            self.restoreUnasgnVar(var)
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse prop status = ", status)
-                    print('  ' * level, "bt_recurse prop pruned = ", prunings)
+    def bt_walk(self, propagator):
+        '''Generator doing depth first search from the current state,
+           with an explicit stack of choice points in place of recursion
+           (so the depth is not limited by Python's recursion limit).
+           Yields each time all variables are assigned; resuming it
+           backtracks from that solution to look for the next one. When
+           it is exhausted all assignments made here have been undone.
+
+           Each choice point is [var, values, i, marker]: the variable
+           branched on, the values of its current domain when it was
+           chosen, the index of the next value to try, and the trail
+           length before its current value was propagated.
+
+           With backjumping (cbj_on) each choice point also has a
+           conflict set in conf: the levels its failed values (and the
+           values pruned before it was chosen) are blamed on.'''
+        stack = []
+        conflicts = self.conflicts
+        conf = []
+        descend = True
+        while True:
+            if descend:
+                if not self.unasgn_vars:
+                    #all variables assigned
+                    if self.trace is not None:
+                        self.trace.solution(len(stack))
+                    #a restarting search keeps the run that found a solution
+                    self.run_decisions = None
+                    if conflicts is not None and stack:
+                        #the next solution may differ at any level
+                        conf[-1] |= (1 << len(stack)) - 2
+                    yield
+                    descend = False
+                    continue
+                var = self.extractMRVvar()
+                vals = var.cur_domain()
+                if self.rng is not None:
+                    self.rng.shuffle(vals)
+                if self.val_order is not None:
+                    vals = self.val_order(self, var, vals)
+                stack.append([var, vals, 0, len(self.trail)])
+                if conflicts is not None:
+                    conf.append(conflicts.explain(var))
+            elif not stack:
+                return
+
+            choice = stack[-1]
+            var, vals, i, marker = choice
+            level = len(stack)
+            if var.is_assigned():
+                #undo the previous value tried
+                self.restore_trail(marker)
+                var.unassign()
+            if i == len(vals):
+                #values exhausted, backtrack
+                if self.trace is not None:
+                    self.trace.backtrack(level, var)
+                stack.pop()
+                self.restoreUnasgnVar(var)
+                descend = False
+                if conflicts is not None:
+                    #jump back to the deepest level in the conflict set
+                    jump = conf.pop()
+                    target = jump.bit_length() - 1
+                    if target < level - 1:
+                        self.nBackjumps = self.nBackjumps + 1
+                        self.nSkipped = self.nSkipped + level - 1 - max(target, 0)
+                    while len(stack) > max(target, 0):
+                        var, vals, i, marker = stack.pop()
+                        conf.pop()
+                        if self.trace is not None:
+                            self.trace.backtrack(len(stack) + 1, var)
+                        self.restore_trail(marker)
+                        var.unassign()
+                        self.restoreUnasgnVar(var)
+                    if stack:
+                        conf[-1] |= jump & ~(1 << target)
+                continue
+
+            if (self.limited or self.run_decisions is not None) and len(vals) > 1:
+                #(a variable with one value left is not a choice)
+                self.limit_reached = self.check_limits()
+                if self.limit_reached is not None:
+                    self.abandon(stack)
+                    return
 
-                if status:
-                    if self.bt_recurse(propagator, level+1):
-                        return True
+            choice[2] = i + 1
+            if self.trace is not None:
+                self.trace.assign(level, var, vals[i])
+            var.assign(vals[i])
+            self.nDecisions = self.nDecisions+1
+            if conflicts is not None:
+                conflicts.levels[var] = level
+                conflicts.conflict = None
 
-                if self.TRACE:
-                    print('  ' * level, "bt_recurse restoring ", prunings)
-                self.restoreValues(prunings)
+            try:
+                status, prunings = propagator(self.csp, var)
+            except SearchLimit as e:
+                #ran out of time propagating: var = vals[i] is unexplored
+                self.limit_reached = e.limit
+                self.restore_trail(marker)
                 var.unassign()
-
-            self.restoreUnasgnVar(var)
-            return False
+                choice[2] = i
+                self.abandon(stack)
+                return
+            if status and self.nogood_index:
+                status = self.nogood_propagate(var)
+            self.nPrunings = self.nPrunings + len(self.trail) - marker
+            if conflicts is not None:
+                conflicts.blame(self.trail, marker, level)
+                if not status:
+                    conflict = conflicts.conflict
+                    if conflict is None:
+                        conflict = (1 << (level + 1)) - 2
+                    conf[-1] |= conflict & ~(1 << level)
+
+            if self.trace is not None:
+                self.trace.prune(level, self.trail, marker)
+                if not status:
+                    self.trace.wipeout(level, var)
+            descend = status
@@ -28,8 +28,10 @@
 
       The list of variable values pairs are all of the values
       the propagator pruned (using the variable's prune_value method). 
-      bt_search NEEDS to know this in order to correctly restore these 
-      values when it undoes a variable assignment.
+      When the csp has a trail attached (csp.trail is not None, as it is
+      during bt_search) prune_value already records every pruning there,
+      so the propagators below do not build the list as they go but
+      return the trail entries they added.
 
       NOTE propagator SHOULD NOT prune a value that has already been 
       pruned! Nor should it prune a value twice
@@ -59,19 +61,33 @@
          
    '''
 
+from collections import deque
+
+BUDGET_INTERVAL = 32    #GAC revisions between checks of a search time limit or stop
+
 def prop_BT(csp, newVar=None):
     '''Do plain backtracking propagation. That is, do no 
     propagation at all. Just check fully instantiated constraints'''
     
     if not newVar:
         return True, []
+    profile = csp.profile
+    conflicts = csp.conflicts
     for c in csp.get_cons_with_var(newVar):
         if c.get_n_unasgn() == 0:
+            if profile is not None:
+                token = profile.start(c)
             vals = []
             vars = c.get_scope()
             for var in vars:
                 vals.append(var.get_assigned_value())
-            if not c.check(vals):
+            status = c.check(vals)
+            if profile is not None:
+                profile.revised(c, token, status)
+            if not status:
+                c.weight = c.weight + 1
+                if conflicts is not None:
+                    conflicts.failed(c)
                 return False, []
     return True, []
 
@@ -79,29 +95,29 @@ def prop_FC(csp, newVar=None):
     '''Do forward checking. That is check constraints with 
        only one uninstantiated variable. Remember to keep 
        track of all pruned variable,value pairs and return '''
-    pruned_values = [] #water if pruned val has to be globel var
+    pruned_values = pruning_list(csp)
+    start = trail_mark(csp)
     if csp == None:
         print("csp is None")
         return
     if newVar== None:
         one_unasgn = []
         if len(csp.get_all_cons()) == 0:
-            return True,pruned_values
+            return True, prunings(csp, pruned_values, start)
         for cons in csp.get_all_cons():
             if cons.get_n_unasgn() == 1:
                 one_unasgn.append(cons)
         for i in one_unasgn:
-            unknown_var = i.get_unasgn_vars()[0]
-            status = FCCHeck_unary(i, unknown_var, pruned_values)
-            pruned_values = list(set(pruned_values)) #getting rid of duplicates
+            unknown_var = i.get_last_unasgn_var()
+            status = FC_revise(csp, i, unknown_var, pruned_values)
             if status == False:
-                return False,pruned_values #not sure if return false should be ehre to at the end
-        return True,pruned_values
+                return False, prunings(csp, pruned_values, start) #not sure if return false should be ehre to at the end
+        return True, prunings(csp, pruned_values, start)
     else: #case where newVar != None
        # pruned_values = []
         unasgn_with_v = []
         if len(csp.get_cons_with_var(newVar)) == 0:
-            return True,pruned_values
+            return True, prunings(csp, pruned_values, start)
         for i in csp.get_cons_with_var(newVar):
             unasgn_with_v.append(i)
         unasgn_V_with_1unkwn = []
@@ -109,14 +125,66 @@ def prop_FC(csp, newVar=None):
             if i.get_n_unasgn() == 1:
                 unasgn_V_with_1unkwn.append(i)
         for i in unasgn_V_with_1unkwn:
-            status = FCCHeck_unary(i, i.get_unasgn_vars()[0],pruned_values)
-            pruned_values = list(set(pruned_values))
+            status = FC_revise(csp, i, i.get_last_unasgn_var(),pruned_values)
             if status == False:
-                return False,pruned_values
-        return True,pruned_values
+                return False, prunings(csp, pruned_values, start)
+        return True, prunings(csp, pruned_values, start)
             
 
+def pruning_list(csp):
+    '''Return the list a propagator should collect its prunings in, or
+       None if the csp has a trail attached that already records them'''
+    if csp is not None and csp.trail is not None:
+        return None
+    return []
+
+def trail_mark(csp):
+    '''Return the length of the csp's trail (0 if it has none), to be
+       passed to prunings when the propagator returns'''
+    if csp is not None and csp.trail is not None:
+        return len(csp.trail)
+    return 0
+
+def prunings(csp, pruned_list, start):
+    '''Return the list of prunings a propagator returns: pruned_list,
+       or if that is None (see pruning_list) the prunings recorded on
+       the trail since start'''
+    if pruned_list is None:
+        return csp.trail[start:]
+    return pruned_list
+
+def FC_revise(csp, cons, var, pruned_values):
+    '''FCCHeck_unary, reported to the csp's profile if it has one. A
+       wipe out bumps the constraint's weight (for dom/wdeg). While
+       searching with backjumping the prunings are explained to
+       csp.conflicts by the assignments of cons's other variables'''
+    profile = csp.profile
+    conflicts = csp.conflicts
+    if conflicts is not None:
+        before = var.curdom
+    if profile is None:
+        status = FCCHeck_unary(cons, var, pruned_values)
+    else:
+        token = profile.start(cons)
+        status = FCCHeck_unary(cons, var, pruned_values)
+        profile.revised(cons, token, status)
+    if conflicts is not None:
+        reason = conflicts.reason(cons, var)
+        m = before & ~var.curdom
+        while m:
+            low = m & -m
+            conflicts.pruned(var, var.dom[low.bit_length() - 1], reason)
+            m ^= low
+        if not status:
+            conflicts.failed(cons)
+    if not status:
+        cons.weight = cons.weight + 1
+    return status
+
 def FCCHeck_unary(cons, var, pruned_values):
+    '''Prune the values of var (the only unassigned variable of cons)
+       that falsify cons. Prunings are appended to pruned_values unless
+       it is None. Returns False on a domain wipe out'''
     unary = False
     if cons.get_scope() == 1:
         unary = True
@@ -125,7 +193,8 @@ def FCCHeck_unary(cons, var, pruned_values):
             #case where you dont need all prev values
             if not cons.check([d]):
                 var.prune_value(d)
-                pruned_values.append((var, d))
+                if pruned_values is not None:
+                    pruned_values.append((var, d))
         elif unary == False:
             cons_scope = cons.get_scope()
             temp_list = []
@@ -136,7 +205,8 @@ def FCCHeck_unary(cons, var, pruned_values):
                     temp_list.append(d)
             if not cons.check(temp_list):
                 var.prune_value(d)
-                pruned_values.append((var, d))
+                if pruned_values is not None:
+                    pruned_values.append((var, d))
             #case where we need to keep track of all prev values in order
     if var.cur_domain_size() == 0:
         return False
@@ -148,7 +218,8 @@ def prop_GAC(csp, newVar=None):
     '''Do GAC propagation. If newVar is None we do initial GAC enforce 
        processing all constraints. Otherwise we do GAC enforce with
        constraints containing newVar on GAC Queue'''
-    pruned_list = []
+    pruned_list = pruning_list(csp)
+    start = trail_mark(csp)
     if newVar == None:
       #  pruned_list = []
         GACQueue = Queue()
@@ -160,10 +231,10 @@ def prop_GAC(csp, newVar=None):
         GAC_return = GAC_helper(csp, GACQueue, pruned_list)
         if GAC_return == True:
            # pruned_list = list(set(pruned_list))
-            return True,pruned_list
+            return True, prunings(csp, pruned_list, start)
         else:
            # pruned_list = list(set(pruned_list))
-            return False,pruned_list
+            return False, prunings(csp, pruned_list, start)
     else:
        # pruned_list = []
         GACQueue = Queue()
@@ -174,51 +245,129 @@ def prop_GAC(csp, newVar=None):
                 GACQueue.enqueue(cons)
         GAC_return = GAC_helper(csp, GACQueue, pruned_list)
         if GAC_return == True:
-            pruned_list = list(set(pruned_list))
-            return True,pruned_list
+            return True, prunings(csp, pruned_list, start)
         else:
-            pruned_list = list(set(pruned_list))
-            return False,pruned_list
+            return False, prunings(csp, pruned_list, start)
        
             
 
-def GAC_helper(csp, GACQueue, pruned_list):
+def prop_CT(csp, newVar=None):
+    '''Do GAC propagation as prop_GAC does, except that every table
+       constraint is filtered with Compact-Table (Constraint.ct_filter:
+       bitsets of valid tuples) instead of scanning support lists.
+       Individual constraints can be given this treatment under
+       prop_GAC with Constraint.compact_table_on.'''
+    pruned_list = pruning_list(csp)
+    start = trail_mark(csp)
+    GACQueue = Queue()
+    if newVar == None:
+        cons = csp.get_all_cons()
+    else:
+        cons = csp.get_cons_with_var(newVar)
+    for c in cons:
+        GACQueue.enqueue(c)
+    status = GAC_helper(csp, GACQueue, pruned_list, True)
+    return status, prunings(csp, pruned_list, start)
+
+def GAC_helper(csp, GACQueue, pruned_list, use_ct=False):
+    '''Revise constraints off GACQueue until it is empty, pruning
+       unsupported values. With use_ct table constraints are filtered
+       with Compact-Table. Returns False on a domain wipe out. While
+       BT searches with a time limit or stop event, every
+       BUDGET_INTERVAL revisions csp.budget.check_budget() is called,
+       which raises SearchLimit when the limit is reached'''
+    profile = csp.profile
+    conflicts = csp.conflicts
+    budget = csp.budget
+    n = 0
     while not GACQueue.is_empty():
+        if budget is not None:
+            #a search time limit can run out (or the search be stopped)
+            #in a long propagation
+            n = n + 1
+            if n % BUDGET_INTERVAL == 0:
+                budget.check_budget()
         C = GACQueue.dequeue()
-        for var in C.get_scope():
-            for d in var.cur_domain():
-                sup = C.has_support(var, d)
-                #find an assignment A for all other variables in scope(C)such that 
-                #C(A U var = c) = True
-                if sup == False:
-                    var.prune_value(d)
-                    pruned_list.append((var, d))
-                    if var.cur_domain_size() == 0:
-                        GACQueue.empty()
-                        return False #DWO happened here
-                    else:
-                        constraints_with_var = csp.get_cons_with_var(var)
-                        if len(constraints_with_var) == 0:
-                            print("\n\n\n\n\There are no cons with var inside GAC helper ")
-                            return False  #there aint no constraints with var
-                        for i in constraints_with_var:
-                            if not GACQueue.contains(i):
-                                GACQueue.enqueue(i)
+        if profile is None:
+            status = GAC_revise(csp, GACQueue, C, pruned_list, use_ct)
+        else:
+            token = profile.start(C)
+            status = GAC_revise(csp, GACQueue, C, pruned_list, use_ct)
+            profile.revised(C, token, status)
+        if not status:
+            C.weight = C.weight + 1     #for dom/wdeg
+            if conflicts is not None:
+                conflicts.failed(C)
+            return False
+    return True
+
+def GAC_revise(csp, GACQueue, C, pruned_list, use_ct=False):
+    '''Prune the values C gives no support, putting the constraints
+       over pruned variables back on GACQueue. Returns False on a
+       domain wipe out. While searching with backjumping each pruning
+       is explained to csp.conflicts by the domains of C's other
+       variables when it is made'''
+    conflicts = csp.conflicts
+    filtered = C.filter_domains()
+    if filtered is None and use_ct:
+        filtered = C.ct_filter()
+    if filtered is not None:
+        #constraint with its own GAC algorithm (e.g. AllDifferent)
+        status, unsupported = filtered
+        if status == False:
+            GACQueue.empty()
+            return False
+        for var, d in unsupported:
+            if conflicts is not None:
+                conflicts.pruned(var, d, conflicts.reason(C, var))
+            if not GAC_prune(csp, GACQueue, var, d, pruned_list):
+                return False
+        return True
+    for var in C.get_scope():
+        for d in var.cur_domain():
+            sup = C.has_support(var, d)
+            #find an assignment A for all other variables in scope(C)such that 
+            #C(A U var = c) = True
+            if sup == False:
+                if conflicts is not None:
+                    conflicts.pruned(var, d, conflicts.reason(C, var))
+                if not GAC_prune(csp, GACQueue, var, d, pruned_list):
+                    return False
+    return True
+
+def GAC_prune(csp, GACQueue, var, d, pruned_list):
+    '''Prune unsupported value d of var and put the constraints over
+       var back on the GAC queue. Returns False on a domain wipe out'''
+    var.prune_value(d)
+    if pruned_list is not None:
+        pruned_list.append((var, d))
+    if var.cur_domain_size() == 0:
+        GACQueue.empty()
+        return False #DWO happened here
+    else:
+        constraints_with_var = csp.get_cons_with_var(var)
+        if len(constraints_with_var) == 0:
+            print("\n\n\n\n\There are no cons with var inside GAC helper ")
+            return False  #there aint no constraints with var
+        for i in constraints_with_var:
+            if not GACQueue.contains(i):
+                GACQueue.enqueue(i)
     return True
-                        
-                    
-    
 
 
 class Queue:
+    '''FIFO work queue of constraints for GAC. Items are kept in a
+       deque with a set mirroring its contents, so enqueue, dequeue and
+       contains are all constant time.'''
     def __init__ (self):
-        self.items = []
+        self.items = deque()
+        self.members = set()
         
     def dequeue(self):
         x = None
-        if(self.q_len() > 0):
-            x = self.items[0]
-            self.items = self.items[1:]
+        if self.items:
+            x = self.items.popleft()
+            self.members.discard(x)
         return x
     
     def is_empty(self):
@@ -226,14 +375,17 @@ class Queue:
     
     def enqueue(self,item):
         self.items.append(item)
+        self.members.add(item)
         
     def q_len(self):
         return len(self.items)
     
     def empty(self):
-        self.items = []
+        self.items.clear()
+        self.members.clear()
         
     def contains(self, item):
-        if (item in self.items):
-            return True
-        return False        
\ No newline at end of file
+        return item in self.members
+
+#name --> propagator, for the tools that take a propagator by name
+PROPAGATORS = {'BT': prop_BT, 'FC': prop_FC, 'GAC': prop_GAC, 'CT': prop_CT}
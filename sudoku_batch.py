@@ -0,0 +1,272 @@
+'''Solve many sudoku boards in parallel.
+
+   solve_boards(boards, ...) fans the boards out to a pool of worker
+   processes, each loading its board into a SudokuTemplate of model 1
+   or 2 (built once per worker process) and searching it with BT, and
+   yields one result per
+   board, either in input order or as they complete. Boards are read
+   lazily, with only a bounded number in flight, so very long inputs
+   can be streamed.
+
+   Each result is a dict with keys
+      'index'      position of the board in the input
+      'board'      the board as given
+      'status'     'solved', 'unsolvable', 'timeout' or 'error'
+      'solution'   list of 9 lists of values, or None
+      'time'       CPU seconds spent in the worker
+      'decisions', 'prunings'   BT statistics
+      'error'      error message for status 'error', otherwise None
+
+   A board that raises, or that runs past the per-board timeout, only
+   produces a result with that status; the rest of the batch goes on.
+   If a worker process dies (is killed, or crashes the interpreter),
+   the pool is replaced and the boards that were in flight are run
+   again one at a time: only a board that kills its worker again gets
+   an 'error' result.
+
+   Run as a script to solve a file of boards, one per line as 81
+   characters (digits, with 0 or . for an empty cell):
+
+      python sudoku_batch.py boards.txt --model 2 --workers 4 --timeout 5
+'''
+
+import sys
+import os
+import time
+import argparse
+import collections
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+from sudoku_csp import sudoku_csp_model_1, sudoku_csp_model_2, SudokuTemplate
+from propagators import PROPAGATORS
+from cspbase import BT
+
+MODELS = {1: sudoku_csp_model_1, 2: sudoku_csp_model_2}
+TEMPLATES = dict()  #model --> SudokuTemplate of this process
+
+
+def get_template(model):
+    '''Return this process's SudokuTemplate for model, building it the
+       first time'''
+    if model not in MODELS:
+        raise ValueError("unknown sudoku model {}".format(model))
+    if model not in TEMPLATES:
+        TEMPLATES[model] = SudokuTemplate(model)
+    return TEMPLATES[model]
+
+
+def parse_board(line):
+    '''Return the board (list of 9 lists) written as 81 characters,
+       digits with 0 or . for an empty cell. Whitespace is ignored.'''
+    cells = [ch for ch in line if not ch.isspace()]
+    if len(cells) != 81:
+        raise ValueError("board must have 81 cells, got {}".format(len(cells)))
+    vals = []
+    for ch in cells:
+        if ch == '.':
+            vals.append(0)
+        elif ch.isdigit():
+            vals.append(int(ch))
+        else:
+            raise ValueError("bad cell {!r} in board".format(ch))
+    return [vals[9 * i:9 * i + 9] for i in range(9)]
+
+
+def format_board(board):
+    '''Inverse of parse_board (empty cells written as 0)'''
+    return ''.join(str(v) for row in board for v in row)
+
+
+def read_boards(f):
+    '''Generate the boards of an open text file, one per line, as
+       strings (they are parsed by the worker, so a malformed line only
+       fails its own board). Blank lines and lines starting with # are
+       skipped.'''
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def solve_board(board, model=1, propagator='GAC', timeout=None):
+    '''Solve one board (a list of 9 lists, or a string for parse_board)
+       in the current process and return its result dict (see the
+       module docstring; 'index' is left to the caller).
+       timeout is in seconds of wall clock time, a search limit of BT
+       (see BT.set_limits).'''
+    result = {'board': board, 'status': None, 'solution': None, 'time': 0.0,
+              'decisions': 0, 'prunings': 0, 'error': None}
+    stime = time.process_time()
+    solver = None
+    try:
+        if isinstance(board, str):
+            board = parse_board(board)
+        csp, var_array = get_template(model).load(board)
+        solver = BT(csp)
+        solver.set_limits(time=timeout)
+        soln = None
+        for soln in solver.solutions(PROPAGATORS[propagator], limit=1):
+            pass
+        if soln is not None:
+            result['status'] = 'solved'
+            result['solution'] = [[soln[var] for var in row] for row in var_array]
+        elif solver.limit_reached is not None:
+            result['status'] = 'timeout'
+        else:
+            result['status'] = 'unsolvable'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+        #the search was cut off somewhere, don't reuse its template
+        TEMPLATES.pop(model, None)
+    if solver is not None:
+        result['decisions'] = solver.nDecisions
+        result['prunings'] = solver.nPrunings
+    result['time'] = time.process_time() - stime
+    return result
+
+
+def error_result(board, e):
+    '''Result dict for a board whose worker failed with exception e'''
+    return {'board': board, 'status': 'error', 'solution': None,
+            'time': 0.0, 'decisions': 0, 'prunings': 0,
+            'error': "{}: {}".format(type(e).__name__, e)}
+
+
+def solve_boards(boards, model=1, propagator='GAC', workers=None,
+                 timeout=None, ordered=True, max_pending=None):
+    '''Generator solving the boards of an iterable on a pool of workers
+       processes (os.cpu_count() by default) and yielding their results
+       (see the module docstring), in input order if ordered, otherwise
+       as they complete. At most max_pending boards (default 4 per
+       worker) are handed to the pool at a time.'''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 4 * workers
+    boards = iter(boards)
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    pending = dict()    #future --> (index, board, run alone)
+    retry = collections.deque()     #(index, board) in flight when the
+                                    #pool broke, to run one at a time
+    done = dict()       #index --> result, for ordered output
+    next_index = 0      #next board to submit
+    next_out = 0        #next result to yield when ordered
+    exhausted = False
+    try:
+        while True:
+            broken = False      #a worker died, found on submit
+            if retry:
+                #suspects run alone, so a broken pool names its board
+                if not pending:
+                    index, board = retry.popleft()
+                    try:
+                        f = pool.submit(solve_board, board, model, propagator, timeout)
+                        pending[f] = (index, board, True)
+                    except BrokenProcessPool:
+                        retry.appendleft((index, board))
+                        broken = True
+            else:
+                while not exhausted and len(pending) < max_pending:
+                    try:
+                        board = next(boards)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    index = next_index
+                    next_index = next_index + 1
+                    try:
+                        f = pool.submit(solve_board, board, model, propagator, timeout)
+                    except BrokenProcessPool:
+                        retry.append((index, board))
+                        broken = True
+                        break
+                    pending[f] = (index, board, False)
+            if not pending and not broken and not retry:
+                break
+            if not broken:
+                finished, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            else:
+                finished = list(pending)
+            results = []
+            for f in finished:
+                index, board, alone = pending.pop(f)
+                try:
+                    result = f.result()
+                except BrokenProcessPool as e:
+                    broken = True
+                    if alone:
+                        #killed its worker even on its own
+                        result = error_result(board, e)
+                    else:
+                        retry.append((index, board))
+                        continue
+                except Exception as e:
+                    result = error_result(board, e)
+                result['index'] = index
+                results.append(result)
+            if broken:
+                #the boards still in flight went down with the pool,
+                #unless they had just finished
+                for f, (index, board, alone) in pending.items():
+                    if f.done() and not f.cancelled() and f.exception() is None:
+                        result = f.result()
+                        result['index'] = index
+                        results.append(result)
+                    else:
+                        retry.append((index, board))
+                pending.clear()
+                pool.shutdown(wait=True, cancel_futures=True)
+                pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            for result in results:
+                if ordered:
+                    done[result['index']] = result
+                else:
+                    yield result
+            while ordered and next_out in done:
+                yield done.pop(next_out)
+                next_out = next_out + 1
+    finally:
+        #if the caller stops early, drop boards not yet started
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve a file of sudoku boards in parallel.")
+    parser.add_argument("boards", help="file with one 81 character board per line (- for stdin)")
+    parser.add_argument("--model", type=int, choices=[1, 2], default=1)
+    parser.add_argument("--prop", choices=sorted(PROPAGATORS), default='GAC')
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="per board time limit in seconds")
+    parser.add_argument("--unordered", action="store_true",
+                        help="write results as they complete")
+    args = parser.parse_args(argv)
+
+    f = sys.stdin if args.boards == '-' else open(args.boards)
+    counts = dict()
+    n = 0
+    stime = time.perf_counter()
+    try:
+        for result in solve_boards(read_boards(f), args.model, args.prop, args.workers,
+                                   args.timeout, not args.unordered):
+            n = n + 1
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            if result['status'] == 'solved':
+                print(result['index'], format_board(result['solution']))
+            else:
+                print(result['index'], result['status'], result['error'] or '')
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    elapsed = time.perf_counter() - stime
+    print("{} boards in {:.2f}s ({:.1f} boards/s): {}".format(
+        n, elapsed, n / elapsed if elapsed > 0 else 0.0,
+        ", ".join("{} {}".format(counts[k], k) for k in sorted(counts))),
+        file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -108,12 +108,7 @@ def sudoku_csp_model_1(initial_sudoku_board):
                 presuccessor_variable = ith_subsquare[presuccessor]
                 successor_variable = ith_subsquare[successor]
                 constraint = Constraint("Cons " + presuccessor_variable.name+","+ successor_variable.name, [presuccessor_variable, successor_variable])
-                sat_tuples = []
-                for value1 in presuccessor_variable.cur_domain():
-                    for value2 in successor_variable.cur_domain():
-                        if value1 != value2:
-                            sat_tuples.append((value1, value2))
-                constraint.add_satisfying_tuples(sat_tuples)
+                constraint.set_relation(not_equal_relation(presuccessor_variable, successor_variable))
                 Constraints.append(constraint)
     #lets do row constraints next
        
@@ -124,12 +119,7 @@ def sudoku_csp_model_1(initial_sudoku_board):
                 presuccessor_variable = ith_row[presuccessor]
                 successor_variable = ith_row[successor] 
                 constraint = Constraint("Cons " + presuccessor_variable.name+","+ successor_variable.name, [presuccessor_variable, successor_variable])
-                sat_tuples = []
-                for value1 in presuccessor_variable.cur_domain():
-                    for value2 in successor_variable.cur_domain():
-                        if value1 != value2:
-                            sat_tuples.append((value1, value2))                
-                constraint.add_satisfying_tuples(sat_tuples)
+                constraint.set_relation(not_equal_relation(presuccessor_variable, successor_variable))
                 Constraints.append(constraint)                 
                 
     
@@ -144,12 +134,7 @@ def sudoku_csp_model_1(initial_sudoku_board):
                 presuccessor_variable = ith_column[presuccessor]
                 successor_variable = ith_column[successor]                 
                 constraint = Constraint("Cons " + presuccessor_variable.name+","+ successor_variable.name, [presuccessor_variable, successor_variable])
-                sat_tuples = []
-                for value1 in presuccessor_variable.cur_domain():
-                    for value2 in successor_variable.cur_domain():
-                        if value1 != value2:
-                            sat_tuples.append((value1, value2))                
-                constraint.add_satisfying_tuples(sat_tuples)
+                constraint.set_relation(not_equal_relation(presuccessor_variable, successor_variable))
                 Constraints.append(constraint)
     if len(Constraints) == 0:
         sudoku_csp.add_constraint([None])
@@ -161,6 +146,21 @@ def sudoku_csp_model_1(initial_sudoku_board):
 #IMPLEMENT
 
 
+def not_equal_relation(var1, var2):
+    '''Return the (shared) relation of satisfying tuples of var1 != var2
+       over their current domains. All the binary constraints of model_1
+       over the same pair of domains share one relation'''
+    dom1 = var1.cur_domain()
+    dom2 = var2.cur_domain()
+    def sat_tuples():
+        tuples = []
+        for value1 in dom1:
+            for value2 in dom2:
+                if value1 != value2:
+                    tuples.append((value1, value2))
+        return tuples
+    return get_relation(("!=", tuple(dom1), tuple(dom2)), sat_tuples)
+
 def get_ith_subsquare(variables, i):
     subsquare_values_to_return = [None]*9
     col_num = (i%3)*3
@@ -171,13 +171,6 @@ def get_ith_subsquare(variables, i):
         subsquare_values_to_return[i] = variables[row_num + row_i][col_num + col_i]
     return subsquare_values_to_return
 
-def compute_new_dom(dom, x):
-    temp = []
-    for l in dom:
-        if not l in x:
-            temp.append(l)
-    return temp
-
 ##############################
 def sudoku_csp_model_2(initial_sudoku_board):
     '''Return a CSP object representing a sudoku CSP problem along 
@@ -241,118 +234,27 @@ def sudoku_csp_model_2(initial_sudoku_board):
     #for i in all_var:
         #print("\n\n\n" + i.name)
     
+    #all-different constraints are AllDifferent global constraints
+    #rather than tables of the up to 9! satisfying tuples
     #lets do subsquare constraints first
     for i in range(9):
         ith_subsquare = get_ith_subsquare(Variables, i)
-        constraint = Constraint("Cons subsquare_" + str(i), ith_subsquare)
-        cur_ith_domain = [] #list of lists [[domain var1], [domain var2],...,[domain varn]]
-        
-        for var_obj in ith_subsquare:
-            cur_ith_domain.append(var_obj.cur_domain())
-            
-        all_possible_tuples = []
-        
-        for cell_0 in cur_ith_domain[0]:
-            cell_1_new_domain = compute_new_dom(cur_ith_domain[1], [cell_0]) #because new cell_1 domain cannot contain same value as cell_0 otherwise it wont satisfy the constraint
-            for cell_1 in cell_1_new_domain:
-                cell_2_new_domain = compute_new_dom(cur_ith_domain[2], [cell_0, cell_1])
-                for cell_2 in cell_2_new_domain:
-                    cell_3_new_domain = compute_new_dom(cur_ith_domain[3], [cell_0, cell_1, cell_2])
-                    for cell_3 in cell_3_new_domain:
-                        cell_4_new_domain = compute_new_dom(cur_ith_domain[4], [cell_0, cell_1, cell_2, cell_3])
-                        for cell_4 in cell_4_new_domain:
-                            cell_5_new_domain = compute_new_dom(cur_ith_domain[5], [cell_0, cell_1, cell_2, cell_3, cell_4])
-                            for cell_5 in cell_5_new_domain:
-                                cell_6_new_domain = compute_new_dom(cur_ith_domain[6], [cell_0, cell_1, cell_2, cell_3, cell_4, cell_5])
-                                for cell_6 in cell_6_new_domain:
-                                    cell_7_new_domain = compute_new_dom(cur_ith_domain[6], [cell_0, cell_1, cell_2, cell_3, cell_4, cell_5, cell_6])
-                                    for cell_7 in cell_7_new_domain:
-                                        cell_8_new_domain = compute_new_dom(cur_ith_domain[6], [cell_0, cell_1, cell_2, cell_3, cell_4, cell_5, cell_6, cell_7])
-                                        for cell_8 in cell_8_new_domain:
-                                            all_possible_tuples.append((cell_0,cell_1,cell_2,cell_3,cell_4,cell_5,cell_6,cell_7,cell_8))        
-    
-    
-        
-       
-                
-        constraint.add_satisfying_tuples(all_possible_tuples)
+        constraint = AllDifferent("Cons subsquare_" + str(i), ith_subsquare)
         sudoku_csp.add_constraint(constraint)
-       # Constraints.append(constraint)
         
-    #lets do row constraints 
     #doing row constraints
     for i in range(9):
         ith_row = Variables[i]
-        constraint = Constraint("Cons row_" + str(i), ith_row)
-        cur_ith_domain = []
-        
-        for var_obj in ith_row:
-            cur_ith_domain.append(var_obj.cur_domain())
-            
-        all_possible_tuples = []
-        
-        for cell_0 in cur_ith_domain[0]:
-            cell_1_new_domain = compute_new_dom(cur_ith_domain[1], [cell_0]) #because new cell_1 domain cannot contain same value as cell_0 otherwise it wont satisfy the constraint
-            for cell_1 in cell_1_new_domain:
-                cell_2_new_domain = compute_new_dom(cur_ith_domain[2], [cell_0, cell_1])
-                for cell_2 in cell_2_new_domain:
-                    cell_3_new_domain = compute_new_dom(cur_ith_domain[3], [cell_0, cell_1, cell_2])
-                    for cell_3 in cell_3_new_domain:
-                        cell_4_new_domain = compute_new_dom(cur_ith_domain[4], [cell_0, cell_1, cell_2, cell_3])
-                        for cell_4 in cell_4_new_domain:
-                            cell_5_new_domain = compute_new_dom(cur_ith_domain[5], [cell_0, cell_1, cell_2, cell_3, cell_4])
-                            for cell_5 in cell_5_new_domain:
-                                cell_6_new_domain = compute_new_dom(cur_ith_domain[6], [cell_0, cell_1, cell_2, cell_3, cell_4, cell_5])
-                                for cell_6 in cell_6_new_domain:
-                                    cell_7_new_domain = compute_new_dom(cur_ith_domain[6], [cell_0, cell_1, cell_2, cell_3, cell_4, cell_5, cell_6])
-                                    for cell_7 in cell_7_new_domain:
-                                        cell_8_new_domain = compute_new_dom(cur_ith_domain[6], [cell_0, cell_1, cell_2, cell_3, cell_4, cell_5, cell_6, cell_7])
-                                        for cell_8 in cell_8_new_domain:
-                                            all_possible_tuples.append((cell_0,cell_1,cell_2,cell_3,cell_4,cell_5,cell_6,cell_7,cell_8))
-        
-        constraint.add_satisfying_tuples(all_possible_tuples)
+        constraint = AllDifferent("Cons row_" + str(i), ith_row)
         sudoku_csp.add_constraint(constraint)
-      #  Constraints.append(constraint)
-    
     
     #column constraints
     for i in range(9):
         ith_column = []
         for rows in range(9):
             ith_column.append(Variables[rows][i])
-        constraint = Constraint("Cons col_" + str(i), ith_column)
-        cur_ith_domain = []
-        
-        for var_obj in ith_column:
-            cur_ith_domain.append(var_obj.cur_domain())
-            
-        all_possible_tuples = []        
-        
-        for cell_0 in cur_ith_domain[0]:
-            cell_1_new_domain = compute_new_dom(cur_ith_domain[1], [cell_0]) #because new cell_1 domain cannot contain same value as cell_0 otherwise it wont satisfy the constraint
-            for cell_1 in cell_1_new_domain:
-                cell_2_new_domain = compute_new_dom(cur_ith_domain[2], [cell_0, cell_1])
-                for cell_2 in cell_2_new_domain:
-                    cell_3_new_domain = compute_new_dom(cur_ith_domain[3], [cell_0, cell_1, cell_2])
-                    for cell_3 in cell_3_new_domain:
-                        cell_4_new_domain = compute_new_dom(cur_ith_domain[4], [cell_0, cell_1, cell_2, cell_3])
-                        for cell_4 in cell_4_new_domain:
-                            cell_5_new_domain = compute_new_dom(cur_ith_domain[5], [cell_0, cell_1, cell_2, cell_3, cell_4])
-                            for cell_5 in cell_5_new_domain:
-                                cell_6_new_domain = compute_new_dom(cur_ith_domain[6], [cell_0, cell_1, cell_2, cell_3, cell_4, cell_5])
-                                for cell_6 in cell_6_new_domain:
-                                    cell_7_new_domain = compute_new_dom(cur_ith_domain[6], [cell_0, cell_1, cell_2, cell_3, cell_4, cell_5, cell_6])
-                                    for cell_7 in cell_7_new_domain:
-                                        cell_8_new_domain = compute_new_dom(cur_ith_domain[6], [cell_0, cell_1, cell_2, cell_3, cell_4, cell_5, cell_6, cell_7])
-                                        for cell_8 in cell_8_new_domain:
-                                            all_possible_tuples.append((cell_0,cell_1,cell_2,cell_3,cell_4,cell_5,cell_6,cell_7,cell_8))     
-        constraint.add_satisfying_tuples(all_possible_tuples)
+        constraint = AllDifferent("Cons col_" + str(i), ith_column)
         sudoku_csp.add_constraint(constraint)
-       # Constraints.append(constraint)
-    
-   
-    #for cons in Constraints:
-        #sudoku_csp.add_constraint(cons)
     
     return sudoku_csp,Variables
        
@@ -363,4 +265,42 @@ def sudoku_csp_model_2(initial_sudoku_board):
 
 
 
-    
\ No newline at end of file
+    
+
+
+class SudokuTemplate:
+    '''A sudoku model (model_1 or model_2) built once, with every cell
+       having domain {1-9}, and then loaded with one board after
+       another. load(board) only sets the initial domain of each cell
+       variable ({i} for a fixed cell, {1-9} for an empty one), so no
+       variables, constraints or tables are rebuilt per board.
+
+       load returns the same (csp, variable_array) pair every time, so
+       a board's solution should be read before the next one is
+       loaded.'''
+
+    def __init__(self, model=1):
+        empty = []
+        for i in range(9):
+            empty.append([0]*9)
+        if model == 1:
+            self.csp, self.variables = sudoku_csp_model_1(empty)
+        elif model == 2:
+            self.csp, self.variables = sudoku_csp_model_2(empty)
+        else:
+            raise ValueError("unknown sudoku model {}".format(model))
+
+    def load(self, board):
+        '''Set the template up for board (same format as for
+           sudoku_csp_model_1) and return sudoku_csp, variable_array'''
+        for row_num in range(9):
+            for column_num in range(9):
+                var = self.variables[row_num][column_num]
+                if var.is_assigned():
+                    var.unassign()
+                current_value = board[row_num][column_num]
+                if current_value == 0:
+                    var.set_initial_domain()
+                else:
+                    var.set_initial_domain([current_value])
+        return self.csp, self.variables
@@ -0,0 +1,147 @@
+'''Solve sudoku boards with a portfolio of configurations.
+
+   Which model (sudoku_csp_model_1 or sudoku_csp_model_2) and which
+   propagator solve a board fastest varies from board to board.
+   race_board(board, configs) starts one process per configuration,
+   each running sudoku_batch.solve_board, takes the first definite
+   answer (solved or unsolvable) and terminates the other processes.
+   A configuration whose process dies without an answer (killed, or
+   crashing the interpreter) just loses the race.
+
+   The result is the winner's result dict (see sudoku_batch) with
+   'config' set to its (model, propagator) pair. If every process
+   died, the result has status 'unknown' and config None. Given a log file, a
+   JSON line per board records the winner and its time, so the
+   defaults can be tuned from real workloads:
+
+      python sudoku_portfolio.py boards.txt --timeout 5 --log wins.jsonl
+'''
+
+import sys
+import time
+import json
+import queue
+import argparse
+import multiprocessing
+
+from sudoku_batch import solve_board, read_boards, format_board
+from propagators import PROPAGATORS
+
+#(model, propagator) pairs raced by default
+CONFIGS = [(2, 'GAC'), (1, 'FC'), (1, 'GAC')]
+POLL_INTERVAL = 0.1     #seconds between checks for dead processes
+
+
+def run_config(index, board, model, propagator, timeout, results):
+    '''Process body: solve board with configuration number index and
+       put (index, result) on the results queue'''
+    results.put((index, solve_board(board, model, propagator, timeout)))
+
+
+def unknown_result(board, exitcodes):
+    '''Result dict for a race whose processes all died, with the given
+       exit codes'''
+    return {'board': board, 'status': 'unknown', 'solution': None,
+            'time': 0.0, 'decisions': 0, 'prunings': 0, 'config': None,
+            'error': "every configuration died (exit codes {})".format(
+                ", ".join(str(code) for code in exitcodes))}
+
+
+def race_board(board, configs=None, timeout=None, log=None):
+    '''Solve board (a list of 9 lists, or a string for parse_board) with
+       every configuration of configs (CONFIGS by default) at once and
+       return the result of the first to give a definite answer. If no
+       configuration does (all hit the timeout or fail), the result of
+       the last one to finish is returned, or one with status 'unknown'
+       if every process died. log is an open text file to
+       append a JSON line about the race to, or None.'''
+    if configs is None:
+        configs = CONFIGS
+    stime = time.perf_counter()
+    results = multiprocessing.Queue()
+    procs = []
+    for index, (model, propagator) in enumerate(configs):
+        p = multiprocessing.Process(target=run_config,
+                                    args=(index, board, model, propagator, timeout, results))
+        p.daemon = True
+        p.start()
+        procs.append(p)
+    winner = None
+    finished = set()    #configurations that have answered or died
+    try:
+        while len(finished) < len(configs):
+            try:
+                index, result = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                #a process that has exited has put its result (if any)
+                #on the queue, so if the queue is still empty the
+                #processes gone without a result died
+                dead = [i for i, p in enumerate(procs)
+                        if i not in finished and not p.is_alive()]
+                if dead and results.empty():
+                    finished.update(dead)
+                continue
+            finished.add(index)
+            result['config'] = configs[index]
+            winner = result
+            if result['status'] in ('solved', 'unsolvable'):
+                break
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        for p in procs:
+            p.join()
+        results.close()
+    if winner is None:
+        winner = unknown_result(board, [p.exitcode for p in procs])
+    if log is not None:
+        log.write(json.dumps({'board': format_board(board) if not isinstance(board, str) else board,
+                              'status': winner['status'], 'winner': winner['config'],
+                              'time': winner['time'],
+                              'wall': time.perf_counter() - stime}) + "\n")
+        log.flush()
+    return winner
+
+
+def parse_config(text):
+    '''Parse a configuration written as MODEL:PROP, e.g. 2:GAC'''
+    model, propagator = text.split(':')
+    if int(model) not in (1, 2) or propagator not in PROPAGATORS:
+        raise argparse.ArgumentTypeError("bad configuration {!r}".format(text))
+    return int(model), propagator
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Race model/propagator configurations on sudoku boards.")
+    parser.add_argument("boards", help="file with one 81 character board per line (- for stdin)")
+    parser.add_argument("--config", type=parse_config, action="append",
+                        help="configuration MODEL:PROP to race, e.g. 2:GAC (repeatable, "
+                             "default {})".format(" ".join("{}:{}".format(*c) for c in CONFIGS)))
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="per board time limit in seconds")
+    parser.add_argument("--log", help="append a JSON line per board to this file")
+    args = parser.parse_args(argv)
+
+    f = sys.stdin if args.boards == '-' else open(args.boards)
+    log = open(args.log, 'a') if args.log else None
+    wins = dict()
+    try:
+        for index, board in enumerate(read_boards(f)):
+            result = race_board(board, args.config, args.timeout, log)
+            config = "{}:{}".format(*result['config']) if result['config'] else '-'
+            if result['status'] == 'solved':
+                wins[config] = wins.get(config, 0) + 1
+                print(index, format_board(result['solution']), config)
+            else:
+                print(index, result['status'], result['error'] or '', config)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+        if log is not None:
+            log.close()
+    print("wins:", ", ".join("{} {}".format(k, wins[k]) for k in sorted(wins)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
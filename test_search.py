@@ -0,0 +1,367 @@
+'''Tests of the search engine and propagators of cspbase/propagators.
+
+   Besides known counts (n-queens), solution counts are checked
+   against brute force enumeration on small random CSPs, under every
+   propagator and heuristic.
+
+   Run with pytest, or as a script (python test_search.py) to run every
+   test and print a summary.
+'''
+
+import sys
+import random
+import itertools
+import threading
+import traceback
+
+from cspbase import Variable, Constraint, AllDifferent, CSP, BT, TraceSink, SearchLimit
+from cspbase import ArrayConstraint, FunctionConstraint, get_relation, numpy
+import propagators
+from propagators import prop_BT, prop_FC, prop_GAC, prop_CT
+from csp_heuristics import HEURISTICS
+from csp_sample_run import nQueens
+
+PROPAGATORS = [prop_BT, prop_FC, prop_GAC, prop_CT]
+
+#number of solutions of n-queens
+QUEENS_SOLUTIONS = {4: 2, 5: 10, 6: 4, 7: 40, 8: 92}
+
+N_RANDOM = 30       #random CSPs per brute force cross check
+
+
+def random_csp(seed, table=Constraint, alldiff=False):
+    '''Small random CSP: 4 to 6 variables with 2 to 4 values each and
+       3 to 6 table constraints (of class table) over 1 to 3 of them,
+       each allowing about 70% of the tuples. With alldiff, also an
+       AllDifferent over 3 of the variables.'''
+    rng = random.Random(seed)
+    vars = [Variable('V{}'.format(i), sorted(rng.sample(range(5), rng.randint(2, 4))))
+            for i in range(rng.randint(4, 6))]
+    csp = CSP("random-{}".format(seed), vars)
+    for k in range(rng.randint(3, 6)):
+        scope = rng.sample(vars, rng.randint(1, 3))
+        c = table("C{}".format(k), scope)
+        c.add_satisfying_tuples([t for t in itertools.product(*[v.domain() for v in scope])
+                                 if rng.random() < 0.7])
+        csp.add_constraint(c)
+    if alldiff:
+        csp.add_constraint(AllDifferent("AllDiff", rng.sample(vars, 3)))
+    return csp
+
+
+class SetFunction(FunctionConstraint):
+    '''FunctionConstraint testing membership in the set of tuples given
+       to add_satisfying_tuples, so random_csp can build it like a table
+       constraint. has_support enumerates the other domains'''
+    def __init__(self, name, scope):
+        self.allowed = set()
+        FunctionConstraint.__init__(self, name, scope, self.allowed_fn)
+
+    def allowed_fn(self, vals):
+        return tuple(vals) in self.allowed
+
+    def add_satisfying_tuples(self, tuples):
+        self.allowed.update(tuple(t) for t in tuples)
+
+
+class SupportedSetFunction(SetFunction):
+    '''SetFunction with a support_fn looking through its tuples'''
+    def __init__(self, name, scope):
+        SetFunction.__init__(self, name, scope)
+        self.support_fn = set_support
+
+
+def set_support(cons, var, val):
+    i = cons.scope.index(var)
+    for t in cons.allowed:
+        if t[i] == val and all(v.in_cur_domain(t[j]) for j, v in enumerate(cons.scope)):
+            return True
+    return False
+
+
+def shared_relation_csp(seed):
+    '''Small random CSP of 5 or 6 variables over 0..3 whose 5 to 8
+       constraints share two random relations of arity 2 and 3 (see
+       get_relation), so Compact-Table keeps state for many constraints
+       over the same table'''
+    rng = random.Random(seed)
+    vars = [Variable('V{}'.format(i), list(range(4))) for i in range(rng.randint(5, 6))]
+    csp = CSP("shared-{}".format(seed), vars)
+    relations = []
+    for arity in (2, 3):
+        tuples = [t for t in itertools.product(range(4), repeat=arity) if rng.random() < 0.5]
+        relations.append((arity, get_relation(("test-shared", seed, arity), lambda: tuples)))
+    for k in range(rng.randint(5, 8)):
+        arity, relation = rng.choice(relations)
+        c = Constraint("C{}".format(k), rng.sample(vars, arity))
+        c.set_relation(relation)
+        csp.add_constraint(c)
+    return csp
+
+
+def brute_force_count(csp):
+    '''Number of solutions of csp, by trying every assignment'''
+    vars = csp.get_all_vars()
+    n = 0
+    for vals in itertools.product(*[v.domain() for v in vars]):
+        value = dict(zip(vars, vals))
+        if all(c.check([value[v] for v in c.get_scope()]) for c in csp.get_all_cons()):
+            n = n + 1
+    return n
+
+
+def cross_check(make_csp, setup=None, propagators=PROPAGATORS):
+    '''Check count_solutions against brute_force_count on the CSPs
+       make_csp(seed) for N_RANDOM seeds, with every propagator and
+       every heuristic of csp_heuristics. setup(solver), if given,
+       configures each solver further'''
+    for seed in range(N_RANDOM):
+        csp = make_csp(seed)
+        count = brute_force_count(csp)
+        for prop in propagators:
+            for name, (var_order, val_order) in sorted(HEURISTICS.items()):
+                solver = BT(csp)
+                solver.set_heuristics(var_order, val_order)
+                if setup is not None:
+                    setup(solver)
+                n = solver.count_solutions(prop)
+                assert n == count, (csp.name, prop.__name__, name, n, count)
+
+
+def test_count_solutions_limit():
+    for prop in PROPAGATORS:
+        solver = BT(nQueens(6))
+        assert solver.count_solutions(prop) == 4
+        assert solver.count_solutions(prop, limit=0) == 0
+        assert solver.count_solutions(prop, limit=1) == 1
+        assert solver.count_solutions(prop, limit=3) == 3
+        assert len(list(solver.solutions(prop, limit=0))) == 0
+        assert len(list(solver.solutions(prop, limit=1))) == 1
+
+
+def test_queens_counts():
+    for n, count in QUEENS_SOLUTIONS.items():
+        for prop in PROPAGATORS:
+            assert BT(nQueens(n)).count_solutions(prop) == count
+
+
+def test_random_counts():
+    cross_check(random_csp)
+
+
+def test_random_counts_alldiff():
+    cross_check(lambda seed: random_csp(seed, alldiff=True))
+
+
+def test_random_counts_shared_tables():
+    cross_check(shared_relation_csp)
+
+
+def test_random_counts_functions():
+    for table in [SetFunction, SupportedSetFunction]:
+        cross_check(lambda seed: random_csp(seed, table=table))
+        cross_check(lambda seed: random_csp(seed, table=table, alldiff=True),
+                    lambda solver: solver.cbj_on())
+
+
+def test_random_counts_array_tables():
+    if numpy is None:
+        return      #ArrayConstraint needs numpy
+    cross_check(lambda seed: random_csp(seed, table=ArrayConstraint))
+    cross_check(lambda seed: random_csp(seed, table=ArrayConstraint, alldiff=True))
+
+
+def test_random_counts_restarts():
+    #runs of one or two decisions, so most searches restart many times
+    #before their first solution and record nogoods
+    for strategy, nogoods in [('luby', True), ('luby', False), ('geometric', True)]:
+        def setup(solver):
+            solver.set_restarts(strategy, base=1, factor=1.5, nogoods=nogoods)
+        cross_check(random_csp, setup)
+    cross_check(lambda seed: random_csp(seed, alldiff=True),
+                lambda solver: solver.set_restarts(base=1))
+
+
+def test_random_counts_cbj():
+    def setup(solver):
+        solver.cbj_on()
+    cross_check(random_csp, setup)
+    cross_check(lambda seed: random_csp(seed, alldiff=True), setup)
+    cross_check(shared_relation_csp, setup)
+
+    def setup_restarts(solver):
+        solver.cbj_on()
+        solver.set_restarts(base=1)
+    cross_check(random_csp, setup_restarts)
+
+
+def test_seeded_searches_repeat():
+    csp = nQueens(20)
+    solver = BT(csp)
+    solver.set_restarts(base=5, seed=3)
+    runs = []
+    for _ in range(3):
+        soln = next(solver.solutions(prop_FC))
+        runs.append((solver.nDecisions, solver.nRestarts,
+                     [soln[v] for v in csp.get_all_vars()]))
+    assert runs[0] == runs[1] == runs[2]
+    solver.bt_search(prop_FC)
+    assert (solver.nDecisions, solver.nRestarts) == runs[0][:2]
+
+
+def test_compact_table_reused():
+    #searches cut off at the first solution leave Compact-Table states
+    #behind; later searches of the same CSP must not trust them
+    for seed in range(N_RANDOM):
+        csp = shared_relation_csp(seed)
+        count = brute_force_count(csp)
+        solver = BT(csp)
+        solver.set_random(seed)
+        for limit in [1, None, 2, None]:
+            n = solver.count_solutions(prop_CT, limit)
+            assert n == (count if limit is None else min(count, limit)), (csp.name, limit)
+
+
+class FailingTrace(TraceSink):
+    '''Raise on the n-th assignment of the search'''
+    def __init__(self, n):
+        TraceSink.__init__(self)
+        self.n = n
+        self.finished = False
+
+    def assign(self, level, var, value):
+        self.n = self.n - 1
+        if self.n == 0:
+            raise RuntimeError("trace failed")
+
+    def finish(self):
+        self.finished = True
+
+
+def test_search_cleans_up_after_error():
+    for prop in PROPAGATORS:
+        csp = nQueens(6)
+        domains = [v.cur_domain() for v in csp.get_all_vars()]
+        solver = BT(csp)
+        trace = FailingTrace(3)
+        solver.trace_on(trace)
+        try:
+            solver.bt_search(prop)
+            assert False, "the trace error was swallowed"
+        except RuntimeError:
+            pass
+        assert trace.finished
+        assert csp.trail is None and csp.conflicts is None
+        assert not any(v.is_assigned() for v in csp.get_all_vars())
+        assert [v.cur_domain() for v in csp.get_all_vars()] == domains
+        solver.trace_off()
+        assert solver.count_solutions(prop) == 4
+
+
+class CountdownBT(BT):
+    '''BT whose time limit runs out at the n-th check made during
+       propagation'''
+    def __init__(self, csp, n):
+        BT.__init__(self, csp)
+        self.n = n
+        self.set_limits(time=1000)
+
+    def check_budget(self):
+        self.n = self.n - 1
+        if self.n == 0:
+            raise SearchLimit('time')
+
+
+def count_open_nodes(csp, nodes, prop):
+    n = 0
+    for node in nodes:
+        for var, dom in zip(csp.get_all_vars(), node):
+            var.set_initial_domain(dom)
+        n = n + BT(csp).count_solutions(prop)
+    for var in csp.get_all_vars():
+        var.set_initial_domain(None)
+    return n
+
+
+def test_time_limit_inside_propagation():
+    for prop in [prop_GAC, prop_CT]:
+        for n in [1, 2, 5, 20]:
+            csp = nQueens(8)
+            solver = CountdownBT(csp, n)
+            solver.open_nodes = []
+            found = solver.count_solutions(prop)
+            assert solver.limit_reached == 'time'
+            assert csp.trail is None and csp.budget is None
+            assert not any(v.is_assigned() for v in csp.get_all_vars())
+            assert found + count_open_nodes(csp, solver.open_nodes, prop) == 92
+        #the root propagation is cut off too, leaving the whole problem
+        csp = nQueens(10)
+        solver = CountdownBT(csp, 1)
+        solver.open_nodes = []
+        assert solver.bt_search(prop) == 'unknown'
+        assert solver.limit_reached == 'time' and solver.nDecisions == 0
+        assert not any(v.is_assigned() for v in csp.get_all_vars())
+        assert count_open_nodes(csp, solver.open_nodes, prop) == 724
+        solver = BT(nQueens(20))
+        solver.set_limits(time=0)
+        assert solver.bt_search(prop) == 'unknown'
+        assert solver.limit_reached == 'time' and solver.nPrunings == 0
+
+
+class RestartRootBT(BT):
+    '''BT whose time limit runs out while the root is propagated again
+       after a restart'''
+    def __init__(self, csp):
+        BT.__init__(self, csp)
+        self.set_limits(time=1000)
+
+    def check_budget(self):
+        if self.nRestarts > 0 and not any(v.is_assigned() for v in self.csp.vars):
+            raise SearchLimit('time')
+
+
+def test_time_limit_after_restart():
+    interval = propagators.BUDGET_INTERVAL
+    propagators.BUDGET_INTERVAL = 1
+    try:
+        csp = nQueens(6)
+        solver = RestartRootBT(csp)
+        solver.set_restarts(base=2)
+        solver.open_nodes = []
+        assert solver.count_solutions(prop_GAC) == 0
+        assert solver.limit_reached == 'time' and solver.nRestarts > 0
+    finally:
+        propagators.BUDGET_INTERVAL = interval
+    assert count_open_nodes(csp, solver.open_nodes, prop_GAC) == 4
+
+
+def test_stop_event():
+    stop = threading.Event()
+    for prop in PROPAGATORS:
+        solver = BT(nQueens(8))
+        solver.set_limits(stop=stop)
+        assert solver.count_solutions(prop) == 92
+        stop.set()
+        assert solver.count_solutions(prop) == 0
+        assert solver.limit_reached == 'stop'
+        stop.clear()
+
+
+def main():
+    tests = [(name, f) for name, f in sorted(globals().items())
+             if name.startswith("test_") and callable(f)]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print("PASS", name)
+        except Exception:
+            failed = failed + 1
+            print("FAIL", name)
+            traceback.print_exc()
+    print("{}/{} tests passed".format(len(tests) - failed, len(tests)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
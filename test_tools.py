@@ -0,0 +1,160 @@
+'''Tests of the tools built on the solver: sudoku_batch,
+   sudoku_portfolio, csp_trace and csp_parallel.
+
+   Run with pytest, or as a script (python test_tools.py) to run every
+   test and print a summary. The worker crash tests rely on worker
+   processes being forked (the default on Linux).
+'''
+
+import os
+import sys
+import time
+import tempfile
+import traceback
+import multiprocessing
+
+import sudoku_batch
+import sudoku_portfolio
+from cspbase import Variable, Constraint, CSP, BT, get_relation
+from propagators import prop_FC
+from csp_trace import BinaryTrace, JSONLinesTrace, read_trace
+from sudoku_batch import solve_boards, format_board
+from sudoku_sample_run import b1, b5, b7
+from csp_parallel import parallel_search
+from sudoku_portfolio import race_board
+
+BOARDS = [format_board(b) for b in (b1, b5, b7)]
+CRASH = "crash"     #board making crashing_solve_board kill its worker
+
+
+def crashing_solve_board(board, model=1, propagator='GAC', timeout=None):
+    '''sudoku_batch.solve_board, except that the board CRASH kills the
+       worker process'''
+    if board == CRASH:
+        os._exit(1)
+    return SOLVE_BOARD(board, model, propagator, timeout)
+
+SOLVE_BOARD = sudoku_batch.solve_board
+
+
+def fc_crashing_solve_board(board, model=1, propagator='GAC', timeout=None):
+    '''sudoku_batch.solve_board, except that configurations using FC
+       kill their process'''
+    if propagator == 'FC':
+        os._exit(1)
+    return SOLVE_BOARD(board, model, propagator, timeout)
+
+
+def test_batch_solves():
+    results = list(solve_boards(BOARDS, workers=2))
+    assert [r['index'] for r in results] == [0, 1, 2]
+    assert [r['status'] for r in results] == ['solved'] * 3
+
+
+def test_batch_worker_dies():
+    boards = BOARDS + [CRASH] + BOARDS + BOARDS
+    sudoku_batch.solve_board = crashing_solve_board
+    try:
+        results = list(solve_boards(boards, workers=2, max_pending=4))
+    finally:
+        sudoku_batch.solve_board = SOLVE_BOARD
+    assert [r['index'] for r in results] == list(range(len(boards)))
+    for r in results:
+        if r['board'] == CRASH:
+            assert r['status'] == 'error'
+            assert 'BrokenProcessPool' in r['error']
+        else:
+            assert r['status'] == 'solved', r
+
+
+def test_portfolio_config_dies():
+    sudoku_portfolio.solve_board = fc_crashing_solve_board
+    try:
+        result = race_board(BOARDS[0], [(1, 'FC'), (1, 'GAC')])
+        assert result['status'] == 'solved' and result['config'] == (1, 'GAC')
+        result = race_board(BOARDS[0], [(1, 'FC'), (2, 'FC')])
+        assert result['status'] == 'unknown' and result['config'] is None
+    finally:
+        sudoku_portfolio.solve_board = SOLVE_BOARD
+    assert multiprocessing.active_children() == []
+
+
+def chain_csp(n):
+    '''CSP of n 0/1 variables in a chain, neighbours different: search
+       goes n levels deep'''
+    vars = [Variable('X{}'.format(i), [0, 1]) for i in range(n)]
+    csp = CSP("chain-{}".format(n), vars)
+    relation = get_relation(("!=", (0, 1)), lambda: [(0, 1), (1, 0)])
+    for i in range(n - 1):
+        c = Constraint("C{}".format(i), [vars[i], vars[i + 1]])
+        c.set_relation(relation)
+        csp.add_constraint(c)
+    return csp
+
+
+def test_trace_deep_round_trip():
+    n = 70000       #more levels than fit in 16 bits
+    csp = chain_csp(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        for make_trace, name in ((BinaryTrace, "deep.trace"), (JSONLinesTrace, "deep.jsonl")):
+            filename = os.path.join(tmp, name)
+            solver = BT(csp)
+            trace = make_trace(filename)
+            solver.trace_on(trace)
+            assert solver.count_solutions(prop_FC, limit=1) == 1
+            trace.close()
+            events = list(read_trace(filename))
+            assert events[0] == ('start', 0, csp.name, None)
+            assigns = [e for e in events if e[0] == 'assign']
+            assert len(assigns) == n
+            assert [e[1] for e in assigns] == list(range(1, n + 1))
+            assert events[-1] == ('solution', n, None, None)
+
+
+def pigeons_or_free():
+    '''CSP with X in {0, 1} and ten pigeons in nine holes that must be
+    in different holes only if X = 1: X = 0 is solved at once, X = 1 is
+    a long search for no solution'''
+    x = Variable('X', [0, 1])
+    pigeons = [Variable('P{}'.format(i), list(range(9))) for i in range(10)]
+    csp = CSP("pigeons-or-free", [x] + pigeons)
+    relation = get_relation(("X=0 or !=", 9), lambda: [
+        (a, b, c) for a in (0, 1) for b in range(9) for c in range(9)
+        if a == 0 or b != c])
+    for i in range(10):
+        for j in range(i + 1, 10):
+            c = Constraint("C{}_{}".format(i, j), [x, pigeons[i], pigeons[j]])
+            c.set_relation(relation)
+            csp.add_constraint(c)
+    return csp
+
+
+def test_parallel_stops_running_workers():
+    stime = time.perf_counter()
+    result = parallel_search(pigeons_or_free, 'FC', workers=2, split_factor=1,
+                             slice=60)
+    assert result['status'] == 'solved'
+    assert result['solution']['X'] == 0
+    #the worker searching X = 1 was stopped, not left running its slice
+    assert time.perf_counter() - stime < 30
+    assert multiprocessing.active_children() == []
+
+
+def main():
+    tests = [(name, f) for name, f in sorted(globals().items())
+             if name.startswith("test_") and callable(f)]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print("PASS", name)
+        except Exception:
+            failed = failed + 1
+            print("FAIL", name)
+            traceback.print_exc()
+    print("{}/{} tests passed".format(len(tests) - failed, len(tests)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())